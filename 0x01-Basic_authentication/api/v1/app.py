@@ -4,14 +4,12 @@ Route module for the API
 """
 from os import getenv
 from api.v1.views import app_views
-from flask import Flask, jsonify, abort, request
+from api.v1 import metrics, profiler
+from flask import Flask, jsonify, abort, request, g
 from flask_cors import (CORS, cross_origin)
 import os
-
-
-app = Flask(__name__)
-app.register_blueprint(app_views)
-CORS(app, resources={r"/api/v1/*": {"origins": "*"}})
+import threading
+import time
 
 
 auth = None
@@ -25,16 +23,17 @@ if auth_type:
         auth = Auth()
 
 
-@app.before_request
 def before_request():
     """
     Task to be done before any function call
     """
+    g.request_started = time.perf_counter()
+    g.profiler = profiler.start()
     if auth is None:
         return
 
     excluded_paths = ['/api/v1/status/', '/api/v1/unauthorized/',
-                      '/api/v1/forbidden/']
+                      '/api/v1/forbidden/', '/api/v1/metrics/']
     if request.path in excluded_paths:
         return
 
@@ -44,32 +43,85 @@ def before_request():
     if auth.authorization_header(request) is None:
         abort(401)
 
-    if auth.current_user(request) is None:
+    auth_started = time.perf_counter()
+    current_user = auth.current_user(request)
+    metrics.observe_auth(type(auth).__name__,
+                         time.perf_counter() - auth_started)
+    if current_user is None:
         abort(403)
 
 
-@app.errorhandler(404)
+def after_request(response):
+    """
+    Record the latency of the request under its route
+    """
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe_request(route, request.method,
+                                time.perf_counter() - started)
+    return response
+
+
+def teardown_request(error=None):
+    """
+    Stop the profiler of the request, if any
+    """
+    sampler = g.pop('profiler', None)
+    if sampler is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        profiler.stop(sampler, request.method, route)
+
+
 def not_found(error) -> str:
     """ Not found handler
     """
     return jsonify({"error": "Not found"}), 404
 
 
-@app.errorhandler(401)
 def unauthorized(error) -> str:
     """ Unauthorized handler
     """
     return jsonify({"error": "Unauthorized"}), 401
 
 
-@app.errorhandler(403)
 def forbidden(error) -> str:
     """ Forbidden handler
     """
     return jsonify({"error": "Forbidden"}), 403
 
 
+def create_app() -> Flask:
+    """
+    Build the Flask application; the object store is loaded on first use
+    """
+    app = Flask(__name__)
+    app.register_blueprint(app_views)
+    CORS(app, resources={r"/api/v1/*": {"origins": "*"}})
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.teardown_request(teardown_request)
+    app.register_error_handler(404, not_found)
+    app.register_error_handler(401, unauthorized)
+    app.register_error_handler(403, forbidden)
+    return app
+
+
+def warm_up_store() -> None:
+    """
+    Load the User store in the background so that the first request
+    that needs it does not pay for the load
+    """
+    from models.user import User
+    threading.Thread(target=User.count, daemon=True).start()
+
+
+app = create_app()
+
+
 if __name__ == "__main__":
     host = getenv("API_HOST", "0.0.0.0")
     port = getenv("API_PORT", "5000")
+    if getenv("STORE_WARMUP"):
+        warm_up_store()
     app.run(host=host, port=port)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Request metrics module: fixed-bucket latency histograms rendered in
+the Prometheus text format
+"""
+from bisect import bisect_left
+from models import base
+import threading
+
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0)
+
+
+class Histogram:
+    """
+    Latency histogram with the fixed BUCKETS upper bounds (seconds)
+    """
+
+    def __init__(self):
+        """
+        Initialise empty buckets
+        """
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float) -> None:
+        """
+        Record one observation
+        """
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def render(self, name: str, labels: str) -> list:
+        """
+        Prometheus sample lines of this histogram
+        """
+        lines = []
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), self.counts):
+            cumulative += count
+            lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                name, labels, bound, cumulative))
+        lines.append('{}_sum{{{}}} {}'.format(name, labels, self.sum))
+        lines.append('{}_count{{{}}} {}'.format(name, labels, self.count))
+        return lines
+
+
+_lock = threading.Lock()
+request_histograms = {}
+auth_histograms = {}
+
+
+def _observe(histograms: dict, key: tuple, seconds: float) -> None:
+    """
+    Record an observation in the histogram of `key`
+    """
+    with _lock:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+
+def observe_request(route: str, method: str, seconds: float) -> None:
+    """
+    Record the latency of a request to a route
+    """
+    _observe(request_histograms, (route, method), seconds)
+
+
+def observe_auth(auth_type: str, seconds: float) -> None:
+    """
+    Record the time spent authenticating a request
+    """
+    _observe(auth_histograms, (auth_type,), seconds)
+
+
+def render() -> str:
+    """
+    All metrics in the Prometheus text exposition format
+    """
+    lines = ['# TYPE api_request_duration_seconds histogram']
+    with _lock:
+        for (route, method), histogram in sorted(request_histograms.items()):
+            lines += histogram.render(
+                'api_request_duration_seconds',
+                'route="{}",method="{}"'.format(route, method))
+        lines.append('# TYPE api_auth_duration_seconds histogram')
+        for (auth_type,), histogram in sorted(auth_histograms.items()):
+            lines += histogram.render(
+                'api_auth_duration_seconds',
+                'auth_type="{}"'.format(auth_type))
+    lines.append('# TYPE api_store_operations_total counter')
+    for operation in ('search', 'save', 'remove', 'file_write'):
+        lines.append('api_store_operations_total{{operation="{}"}} {}'.format(
+            operation, base.STATS[operation]))
+    lines.append('# TYPE api_store_file_write_bytes_total counter')
+    lines.append('api_store_file_write_bytes_total {}'.format(
+        base.STATS['file_write_bytes']))
+    return '\n'.join(lines) + '\n'
@@ -5,11 +5,16 @@ from datetime import datetime
 from typing import TypeVar, List, Iterable
 from os import path
 import json
+import threading
 import uuid
 
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
 DATA = {}
+LOADED = set()
+LOAD_LOCK = threading.Lock()
+STATS = {'search': 0, 'save': 0, 'remove': 0, 'file_write': 0,
+         'file_write_bytes': 0}
 
 
 class Base():
@@ -63,14 +68,24 @@ class Base():
         """
         s_class = cls.__name__
         file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
-        if not path.exists(file_path):
-            return
+        objs = {}
+        if path.exists(file_path):
+            with open(file_path, 'r') as f:
+                objs_json = json.load(f)
+                for obj_id, obj_json in objs_json.items():
+                    objs[obj_id] = cls(**obj_json)
+        DATA[s_class] = objs
+        LOADED.add(s_class)
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+    @classmethod
+    def _ensure_loaded(cls):
+        """ Load all objects from file on first access
+        """
+        if cls.__name__ in LOADED:
+            return
+        with LOAD_LOCK:
+            if cls.__name__ not in LOADED:
+                cls.load_from_file()
 
     @classmethod
     def save_to_file(cls):
@@ -82,13 +97,18 @@ class Base():
         for obj_id, obj in DATA[s_class].items():
             objs_json[obj_id] = obj.to_json(True)
 
+        content = json.dumps(objs_json)
         with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+            f.write(content)
+        STATS['file_write'] += 1
+        STATS['file_write_bytes'] += len(content)
 
     def save(self):
         """ Save current object
         """
+        self.__class__._ensure_loaded()
         s_class = self.__class__.__name__
+        STATS['save'] += 1
         self.updated_at = datetime.utcnow()
         DATA[s_class][self.id] = self
         self.__class__.save_to_file()
@@ -96,7 +116,9 @@ class Base():
     def remove(self):
         """ Remove object
         """
+        self.__class__._ensure_loaded()
         s_class = self.__class__.__name__
+        STATS['remove'] += 1
         if DATA[s_class].get(self.id) is not None:
             del DATA[s_class][self.id]
             self.__class__.save_to_file()
@@ -105,6 +127,7 @@ class Base():
     def count(cls) -> int:
         """ Count all objects
         """
+        cls._ensure_loaded()
         s_class = cls.__name__
         return len(DATA[s_class].keys())
 
@@ -118,6 +141,7 @@ class Base():
     def get(cls, id: str) -> TypeVar('Base'):
         """ Return one object by ID
         """
+        cls._ensure_loaded()
         s_class = cls.__name__
         return DATA[s_class].get(id)
 
@@ -125,7 +149,9 @@ class Base():
     def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
         """
+        cls._ensure_loaded()
         s_class = cls.__name__
+        STATS['search'] += 1
         def _search(obj):
             if len(attributes) == 0:
                 return True
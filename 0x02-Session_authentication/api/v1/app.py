@@ -4,40 +4,54 @@ Route module for the API
 """
 from os import getenv
 from api.v1.views import app_views
-from flask import Flask, jsonify, abort, request
+from api.v1 import metrics
+from models.base import reload_changed
+from flask import Flask, jsonify, abort, request, g
 from flask_cors import (CORS, cross_origin)
-import os
+import threading
+import time
 
 
-app = Flask(__name__)
-app.register_blueprint(app_views)
-CORS(app, resources={r"/api/v1/*": {"origins": "*"}})
+auth = None
 
 
-auth = None
-auth_type = getenv('AUTH_TYPE')
-if auth_type:
+def load_auth(auth_type: str):
+    """
+    Import and build the auth backend selected by AUTH_TYPE, if any;
+    the other backends are never imported
+    """
+    if not auth_type:
+        return None
     if auth_type == 'basic_auth':
         from api.v1.auth.basic_auth import BasicAuth
-        auth = BasicAuth()
-    elif auth_type == 'session_auth':
+        return BasicAuth()
+    if auth_type == 'session_auth':
         from api.v1.auth.session_auth import SessionAuth
-        auth = SessionAuth()
-    else:
-        from api.v1.auth.auth import Auth
-        auth = Auth()
+        return SessionAuth()
+    if auth_type == 'session_exp_auth':
+        from api.v1.auth.session_exp_auth import SessionExpAuth
+        return SessionExpAuth()
+    if auth_type == 'session_db_auth':
+        from api.v1.auth.session_db_auth import SessionDBAuth
+        return SessionDBAuth()
+    if auth_type == 'signed_session':
+        from api.v1.auth.signed_session_auth import SignedSessionAuth
+        return SignedSessionAuth()
+    from api.v1.auth.auth import Auth
+    return Auth()
 
 
-@app.before_request
 def before_request():
     """
     Task to be done before any function call
     """
+    g.request_started = time.perf_counter()
+    reload_changed()
     if auth is None:
         return
 
     excluded_paths = ['/api/v1/status/', '/api/v1/unauthorized/',
-                      '/api/v1/forbidden/',
+                      '/api/v1/forbidden/', '/api/v1/metrics/',
                       '/api/v1/auth_session/login/']
     if request.path in excluded_paths:
         return
@@ -45,41 +59,126 @@ def before_request():
     if not auth.require_auth(request.path, excluded_paths):
         return
 
-    if auth.authorization_header(request) is None and \
-            auth.session_cookie(request) is None:
-        abort(401)
-
-    if auth.current_user(request) is None:
-        abort(403)
-
+    # Resolve the principal once per request; the credential probes are
+    # only needed afterwards to tell a 401 apart from a 403
+    auth_started = time.perf_counter()
     current_user = auth.current_user(request)
+    metrics.observe_auth(type(auth).__name__,
+                         time.perf_counter() - auth_started)
     if current_user is None:
+        if auth.authorization_header(request) is None and \
+                auth.session_cookie(request) is None:
+            abort(401)
         abort(403)
     request.current_user = current_user
 
 
-@app.errorhandler(404)
+def after_request(response):
+    """
+    Record the request latency under its route
+    """
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe_request(route, request.method,
+                                time.perf_counter() - started)
+    return response
+
+
+def compress(response):
+    """
+    Compress the response, see api.v1.compression
+    """
+    from api.v1.compression import compress_response
+    return compress_response(response, request)
+
+
+def start_profiler():
+    """
+    Start the profiler of the request if it is sampled
+    """
+    from api.v1 import profiler
+    g.profiler = profiler.start()
+
+
+def stop_profiler(error=None):
+    """
+    Stop the profiler of the request, if any
+    """
+    sampler = g.pop('profiler', None)
+    if sampler is not None:
+        from api.v1 import profiler
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        profiler.stop(sampler, request.method, route)
+
+
 def not_found(error) -> str:
     """ Not found handler
     """
     return jsonify({"error": "Not found"}), 404
 
 
-@app.errorhandler(401)
 def unauthorized(error) -> str:
     """ Unauthorized handler
     """
     return jsonify({"error": "Unauthorized"}), 401
 
 
-@app.errorhandler(403)
 def forbidden(error) -> str:
     """ Forbidden handler
     """
     return jsonify({"error": "Forbidden"}), 403
 
 
+def precondition_failed(error) -> str:
+    """ Precondition failed handler
+    """
+    return jsonify({"error": "Precondition failed"}), 412
+
+
+def create_app() -> Flask:
+    """
+    Build the Flask application with the auth backend selected by
+    AUTH_TYPE, response compression unless COMPRESS=0 and the profiler
+    if PROFILE_SAMPLE_RATE is set. Only the selected auth backend is
+    imported, and the profiler only when enabled. The object store is
+    loaded on first use.
+    """
+    global auth
+    auth = load_auth(getenv('AUTH_TYPE'))
+    app = Flask(__name__)
+    app.register_blueprint(app_views)
+    CORS(app, resources={r"/api/v1/*": {"origins": "*"}})
+    if getenv('PROFILE_SAMPLE_RATE', '0') not in ('', '0'):
+        app.before_request(start_profiler)
+        app.teardown_request(stop_profiler)
+    app.before_request(before_request)
+    # after_request functions run last registered first
+    app.after_request(after_request)
+    if getenv('COMPRESS', '1') != '0':
+        app.after_request(compress)
+    app.register_error_handler(404, not_found)
+    app.register_error_handler(401, unauthorized)
+    app.register_error_handler(403, forbidden)
+    app.register_error_handler(412, precondition_failed)
+    return app
+
+
+def warm_up_store() -> None:
+    """
+    Load the User store in the background so that the first request
+    that needs it does not pay for the load
+    """
+    from models.user import User
+    threading.Thread(target=User.count, daemon=True).start()
+
+
+app = create_app()
+
+
 if __name__ == "__main__":
     host = getenv("API_HOST", "0.0.0.0")
     port = getenv("API_PORT", "5000")
+    if getenv("STORE_WARMUP"):
+        warm_up_store()
     app.run(host=host, port=port)
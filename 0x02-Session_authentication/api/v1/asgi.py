@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+ASGI entry point for the API
+
+Serves the same Flask app (every route of app_views) behind an ASGI
+server, e.g.:
+
+    $ hypercorn api.v1.asgi:asgi_app --bind 0.0.0.0:5000
+
+Each request runs on a pool of ASGI_THREADS threads (default 32), so
+password checks and store writes never block the event loop, and idle
+keep-alive connections do not hold a thread. It is not faster than the
+threaded Flask server: `python3 -m api.v1.bench_asgi` compares them.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from os import getenv
+from tempfile import SpooledTemporaryFile
+from api.v1.app import app
+import asyncio
+import sys
+
+
+try:
+    ASGI_THREADS = int(getenv('ASGI_THREADS', 32))
+except ValueError:
+    ASGI_THREADS = 32
+executor = ThreadPoolExecutor(max_workers=ASGI_THREADS,
+                              thread_name_prefix='asgi')
+
+
+def _environ(scope: dict, body) -> dict:
+    """
+    WSGI environ of an ASGI http scope and its request body
+    """
+    script_name = scope.get('root_path', '').encode().decode('latin1')
+    path_info = scope['path'].encode().decode('latin1')
+    if path_info.startswith(script_name):
+        path_info = path_info[len(script_name):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name,
+        'PATH_INFO': path_info,
+        'QUERY_STRING': scope['query_string'].decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope['http_version']),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin1').upper().replace('-', '_')
+        if name not in ('CONTENT_LENGTH', 'CONTENT_TYPE'):
+            name = 'HTTP_' + name
+        value = value.decode('latin1')
+        if name in environ:
+            separator = '; ' if name == 'HTTP_COOKIE' else ','
+            value = environ[name] + separator + value
+        environ[name] = value
+    return environ
+
+
+class WsgiToAsgi:
+    """
+    ASGI application running a WSGI application on a thread pool
+    """
+
+    def __init__(self, wsgi_app, pool: ThreadPoolExecutor):
+        """
+        Wrap wsgi_app, whose requests run on `pool`
+        """
+        self.wsgi_app = wsgi_app
+        self.pool = pool
+
+    async def __call__(self, scope, receive, send):
+        """
+        Serve one ASGI connection
+        """
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError("Unsupported scope type: " + scope['type'])
+
+        with SpooledTemporaryFile(max_size=65536) as body:
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    return
+                body.write(message.get('body', b''))
+                if not message.get('more_body'):
+                    break
+            body.seek(0)
+            loop = asyncio.get_running_loop()
+
+            def send_from_thread(message):
+                asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+            await loop.run_in_executor(self.pool, self._run, scope, body,
+                                       send_from_thread)
+
+    async def _lifespan(self, receive, send):
+        """
+        Acknowledge the server startup and shutdown
+        """
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _run(self, scope, body, send):
+        """
+        Run the WSGI app for one request, on a thread of the pool
+        """
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info is not None and response.get('sent'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['start'] = {
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(name.lower().encode('latin1'),
+                             value.encode('latin1'))
+                            for name, value in headers]}
+
+        def send_start():
+            if not response.get('sent'):
+                response['sent'] = True
+                send(response['start'])
+
+        result = self.wsgi_app(_environ(scope, body), start_response)
+        try:
+            for chunk in result:
+                if chunk:
+                    send_start()
+                    send({'type': 'http.response.body', 'body': chunk,
+                          'more_body': True})
+            send_start()
+            send({'type': 'http.response.body'})
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+
+asgi_app = WsgiToAsgi(app, executor)
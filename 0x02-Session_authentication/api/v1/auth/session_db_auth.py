@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Session Authentication backed by a persistent store module
+"""
+
+from api.v1.auth.session_exp_auth import SessionExpAuth
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from models.user_session import UserSession
+import os
+import time
+
+
+class SessionDBAuth(SessionExpAuth):
+    """
+    Session Auth class storing sessions in the UserSession file store.
+
+    The in-memory session dict inherited from SessionExpAuth acts as a
+    read-through LRU cache (capped by SESSION_MAX) in front of the store,
+    and unknown session IDs are remembered so they do not hit the store
+    again. Like the session dict, both are shared by every instance.
+
+    The store file is shared by every worker process through the Base
+    file lock: each login or logout rewrites the whole file and makes
+    every other worker reload it at its next request, so both cost
+    O(number of sessions). When the store changed, cached sessions it
+    no longer holds are dropped. Expired sessions are swept from the
+    store when a session is saved, at most every SESSION_SWEEP_INTERVAL
+    seconds (default 60).
+
+    `python3 -m api.v1.bench_sessions` checks the time of a cache hit
+    against its budget.
+    """
+    _unknown_session_ids = OrderedDict()
+    _store_generation = None
+    _next_sweep = 0
+
+    def __init__(self):
+        """
+        Read the cache size and sweep interval from the environment
+        """
+        super().__init__()
+        try:
+            self.unknown_cache_size = int(
+                os.getenv('SESSION_UNKNOWN_CACHE_SIZE', 1024))
+        except ValueError:
+            self.unknown_cache_size = 1024
+        try:
+            self.sweep_interval = int(
+                os.getenv('SESSION_SWEEP_INTERVAL', 60))
+        except ValueError:
+            self.sweep_interval = 60
+
+    def _sync_store(self) -> None:
+        """
+        Drop cached sessions that are no longer in the store if it
+        changed since the last call
+        """
+        generation = UserSession.generation()
+        if generation == SessionDBAuth._store_generation:
+            return
+
+        with self._lock:
+            SessionDBAuth._store_generation = generation
+            self._unknown_session_ids.clear()
+            for session_id in list(self.user_id_by_session_id):
+                if UserSession.get(session_id) is None:
+                    del self.user_id_by_session_id[session_id]
+
+    def _sweep_expired(self) -> int:
+        """
+        Remove the expired sessions from the store if the sweep is due;
+        return how many were removed
+        """
+        now = time.time()
+        if self.session_duration <= 0 or now < SessionDBAuth._next_sweep:
+            return 0
+        SessionDBAuth._next_sweep = now + self.sweep_interval
+        cutoff = datetime.utcnow() - timedelta(seconds=self.session_duration)
+        return UserSession.remove_where(
+            lambda user_session: user_session.created_at <= cutoff)
+
+    def create_session(self, user_id: str = None) -> str:
+        """
+        Create a session and persist it as a UserSession
+        """
+        session_id = super().create_session(user_id)
+        if session_id is None:
+            return None
+
+        self._sweep_expired()
+        UserSession(id=session_id, user_id=user_id,
+                    session_id=session_id).save()
+        return session_id
+
+    def user_id_for_session_id(self, session_id: str = None) -> str:
+        """
+        Return the user ID of a session, reading through to the store
+        on a cache miss
+        """
+        if session_id is None or not isinstance(session_id, str):
+            return None
+
+        self._sync_store()
+        user_id = super().user_id_for_session_id(session_id)
+        if user_id is not None:
+            return user_id
+
+        with self._lock:
+            if session_id in self._unknown_session_ids:
+                self._unknown_session_ids.move_to_end(session_id)
+                return None
+
+        user_session = UserSession.get(session_id)
+        if user_session is None:
+            with self._lock:
+                self._unknown_session_ids[session_id] = True
+                while len(self._unknown_session_ids) > \
+                        self.unknown_cache_size:
+                    self._unknown_session_ids.popitem(last=False)
+            return None
+
+        # UserSession timestamps are UTC, the cache uses local time
+        age = datetime.utcnow() - user_session.created_at
+        if self.session_duration > 0 and \
+                age > timedelta(seconds=self.session_duration):
+            user_session.remove()
+            return None
+
+        self._remember_session(session_id, user_session.user_id,
+                               datetime.now() - age)
+        return user_session.user_id
+
+    def destroy_session(self, request=None) -> bool:
+        """
+        Destroy the session in the cache and in the store
+        """
+        if request is None:
+            return False
+        session_id = self.session_cookie(request)
+        if self.user_id_for_session_id(session_id) is None:
+            return False
+
+        with self._lock:
+            self.user_id_by_session_id.pop(session_id, None)
+        user_session = UserSession.get(session_id)
+        if user_session is not None:
+            user_session.remove()
+        return True
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Session Authentication with expiration module
+"""
+
+from api.v1.auth.session_auth import SessionAuth
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import heapq
+import os
+import threading
+
+
+class SessionExpAuth(SessionAuth):
+    """
+    Session Auth class with session expiry and a hard cap on sessions.
+
+    Like the session dict, the expiry heap, its lock and the eviction
+    counters are class attributes, shared by every instance: the views
+    import `api.v1.app.auth`, which under `python3 -m api.v1.app` is a
+    different instance from the one used by before_request.
+    """
+    user_id_by_session_id = OrderedDict()
+    _expiry_heap = []
+    _lock = threading.RLock()
+    evictions = {'expired': 0, 'capacity': 0}
+
+    def __init__(self):
+        """
+        Read SESSION_DURATION (seconds) and SESSION_MAX from the environment
+        """
+        try:
+            self.session_duration = int(os.getenv('SESSION_DURATION', 0))
+        except ValueError:
+            self.session_duration = 0
+        try:
+            self.session_max = int(os.getenv('SESSION_MAX', 0))
+        except ValueError:
+            self.session_max = 0
+
+    def create_session(self, user_id: str = None) -> str:
+        """
+        Create a Session ID recording its creation time
+        """
+        session_id = super().create_session(user_id)
+        if session_id is None:
+            return None
+
+        self._remember_session(session_id, user_id, datetime.now())
+        return session_id
+
+    def _remember_session(self, session_id: str, user_id: str,
+                          created_at: datetime) -> None:
+        """
+        Store a session and schedule its expiry
+        """
+        with self._lock:
+            self.user_id_by_session_id[session_id] = {
+                'user_id': user_id,
+                'created_at': created_at,
+            }
+            if self.session_duration > 0:
+                expires_at = created_at + \
+                    timedelta(seconds=self.session_duration)
+                heapq.heappush(self._expiry_heap, (expires_at, session_id))
+            self._evict_expired(datetime.now())
+            if self.session_max > 0:
+                while len(self.user_id_by_session_id) > self.session_max:
+                    self.user_id_by_session_id.popitem(last=False)
+                    self.evictions['capacity'] += 1
+
+    def user_id_for_session_id(self, session_id: str = None) -> str:
+        """
+        Return the user ID of a session that has not expired
+        """
+        if session_id is None or not isinstance(session_id, str):
+            return None
+
+        with self._lock:
+            self._evict_expired(datetime.now())
+            session = self.user_id_by_session_id.get(session_id)
+            if session is None or 'created_at' not in session:
+                return None
+            # Most recently used sessions are evicted last
+            self.user_id_by_session_id.move_to_end(session_id)
+            return session.get('user_id')
+
+    def destroy_session(self, request=None) -> bool:
+        """
+        Destroy the session under the store lock
+        """
+        with self._lock:
+            return super().destroy_session(request)
+
+    def _evict_expired(self, now: datetime) -> None:
+        """
+        Pop expired sessions off the expiry heap; entries left behind by
+        logouts or capacity evictions are skipped
+        """
+        duration = timedelta(seconds=self.session_duration)
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            expires_at, session_id = heapq.heappop(self._expiry_heap)
+            session = self.user_id_by_session_id.get(session_id)
+            if session is None:
+                continue
+            if session['created_at'] + duration != expires_at:
+                continue
+            del self.user_id_by_session_id[session_id]
+            self.evictions['expired'] += 1
+
+    def session_stats(self) -> dict:
+        """
+        Return the number of live sessions and eviction counters
+        """
+        with self._lock:
+            self._evict_expired(datetime.now())
+            return {
+                'live_sessions': len(self.user_id_by_session_id),
+                'expired_evictions': self.evictions['expired'],
+                'capacity_evictions': self.evictions['capacity'],
+            }
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Stateless signed Session Authentication module
+"""
+
+from api.v1.auth.session_auth import SessionAuth
+from models.user import User
+from contextlib import contextmanager
+import base64
+import fcntl
+import hashlib
+import hmac
+import os
+import threading
+import time
+import uuid
+
+
+REVOCATION_FILE = ".db_RevokedToken.log"
+DEFAULT_DURATION = 86400
+
+
+def _b64encode(data: bytes) -> str:
+    """
+    URL-safe base64 without padding
+    """
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(data: str) -> bytes:
+    """
+    Decode URL-safe base64 without padding
+    """
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+class RevocationList:
+    """
+    Set of revoked token IDs with a Bloom filter in front so that the
+    common case (token not revoked) never touches the set.
+
+    With a `path`, revocations are appended to that file and read back by
+    every process using it, so a logout in one worker is seen by all of
+    them: each check costs one stat() and only new lines are read. The
+    file is compacted by prune() under the `path`.lock file lock.
+    """
+
+    def __init__(self, path: str = None, bits: int = 1 << 16,
+                 hashes: int = 4, prune_interval: int = 60):
+        """
+        Initialise an empty filter of `bits` bits
+        """
+        self.path = path
+        self.bits = bits
+        self.hashes = hashes
+        self.prune_interval = prune_interval
+        self._filter = bytearray(bits // 8)
+        self._revoked = {}
+        self._lock = threading.Lock()
+        self._file_id = None
+        self._offset = 0
+        self._next_prune = 0
+
+    def _positions(self, token_id: str):
+        """
+        Bit positions of a token ID in the filter
+        """
+        digest = hashlib.sha256(token_id.encode()).digest()
+        for i in range(self.hashes):
+            chunk = digest[i * 4:(i + 1) * 4]
+            yield int.from_bytes(chunk, 'big') % self.bits
+
+    def _set_bits(self, bloom: bytearray, token_id: str) -> None:
+        """
+        Set the bits of a token ID in a filter
+        """
+        for pos in self._positions(token_id):
+            bloom[pos // 8] |= 1 << (pos % 8)
+
+    @contextmanager
+    def _file_lock(self):
+        """
+        Serialise appends and compactions across processes
+        """
+        with open(self.path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _sync(self) -> None:
+        """
+        Read the revocations other processes appended since the last
+        call, or reload everything if the file was compacted
+        """
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return
+        if (st.st_dev, st.st_ino) == self._file_id and \
+                st.st_size == self._offset:
+            return
+        with self._lock:
+            try:
+                with open(self.path, 'rb') as f:
+                    st = os.fstat(f.fileno())
+                    file_id = (st.st_dev, st.st_ino)
+                    reload = file_id != self._file_id
+                    offset = 0 if reload else self._offset
+                    f.seek(offset)
+                    data = f.read()
+            except OSError:
+                return
+            # A line still being appended is read on the next call
+            data = data[:data.rfind(b'\n') + 1]
+            entries = []
+            for line in data.decode().splitlines():
+                token_id, _, expires = line.partition(' ')
+                entries.append((token_id, int(expires or 0)))
+            if reload:
+                self._swap(dict(entries))
+            else:
+                for token_id, expires in entries:
+                    self._revoked[token_id] = expires
+                    self._set_bits(self._filter, token_id)
+            self._file_id = file_id
+            self._offset = offset + len(data)
+
+    def _swap(self, revoked: dict) -> None:
+        """
+        Replace the revoked set with a filter built aside, so that
+        concurrent lookups never see a partly rebuilt filter
+        """
+        bloom = bytearray(self.bits // 8)
+        for token_id in revoked:
+            self._set_bits(bloom, token_id)
+        self._revoked = revoked
+        self._filter = bloom
+
+    def add(self, token_id: str, expires: int) -> None:
+        """
+        Revoke a token ID until its expiry time
+        """
+        now = int(time.time())
+        if now >= self._next_prune:
+            self._next_prune = now + self.prune_interval
+            self.prune(now)
+        with self._lock:
+            self._revoked[token_id] = expires
+            self._set_bits(self._filter, token_id)
+        if self.path is None:
+            return
+        with self._file_lock():
+            with open(self.path, 'a') as f:
+                f.write("{} {}\n".format(token_id, expires))
+
+    def __contains__(self, token_id: str) -> bool:
+        """
+        Check whether a token ID was revoked
+        """
+        if self.path is not None:
+            self._sync()
+        bloom = self._filter
+        for pos in self._positions(token_id):
+            if not bloom[pos // 8] & (1 << (pos % 8)):
+                return False
+        return token_id in self._revoked
+
+    def prune(self, now: int) -> None:
+        """
+        Forget tokens that have expired anyway, rebuild the filter and
+        compact the file
+        """
+        if self.path is None:
+            with self._lock:
+                self._swap({token_id: expires
+                            for token_id, expires in self._revoked.items()
+                            if expires > now})
+            return
+        with self._file_lock():
+            self._sync()
+            with self._lock:
+                self._swap({token_id: expires
+                            for token_id, expires in self._revoked.items()
+                            if expires > now})
+                content = "".join("{} {}\n".format(token_id, expires)
+                                  for token_id, expires
+                                  in self._revoked.items())
+                tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+                with open(tmp_path, 'w') as f:
+                    f.write(content)
+                os.replace(tmp_path, self.path)
+                st = os.stat(self.path)
+                self._file_id = (st.st_dev, st.st_ino)
+                self._offset = st.st_size
+
+
+class SignedSessionAuth(SessionAuth):
+    """
+    Session Auth class whose session cookie is an HMAC-signed token
+    carrying the user ID, issue time and expiry, so no session state
+    is kept on the server.
+
+    SESSION_SECRET holds a comma-separated list of secrets: the first one
+    signs new tokens and all of them are accepted, which allows keys to
+    be rotated without logging everybody out.
+
+    Every token expires after SESSION_DURATION seconds (default one
+    day), so that revoked tokens are only kept until then in
+    REVOCATION_FILE, shared by every instance and every worker process
+    started in the same directory.
+    """
+    revoked = RevocationList(REVOCATION_FILE)
+
+    def __init__(self):
+        """
+        Read the secrets and SESSION_DURATION (seconds) from the environment
+        """
+        secrets = os.getenv('SESSION_SECRET', '')
+        self.secrets = [s.encode() for s in secrets.split(',') if s]
+        if not self.secrets:
+            raise ValueError("SESSION_SECRET must be set for signed sessions")
+        try:
+            self.session_duration = int(os.getenv('SESSION_DURATION',
+                                                  DEFAULT_DURATION))
+        except ValueError:
+            self.session_duration = DEFAULT_DURATION
+        if self.session_duration <= 0:
+            raise ValueError("SESSION_DURATION must be positive for signed "
+                             "sessions")
+
+    def _sign(self, payload: str, secret: bytes) -> str:
+        """
+        Signature of a payload with one secret
+        """
+        return _b64encode(hmac.new(secret, payload.encode(),
+                                   hashlib.sha256).digest())
+
+    def create_session(self, user_id: str = None) -> str:
+        """
+        Create a signed session token for a user_id
+        """
+        if user_id is None or not isinstance(user_id, str):
+            return None
+
+        issued = int(time.time())
+        expires = issued + self.session_duration
+        payload = _b64encode("{}|{}|{}|{}".format(
+            user_id, issued, expires, uuid.uuid4().hex).encode())
+        return "{}.{}".format(payload, self._sign(payload, self.secrets[0]))
+
+    def _claims(self, session_id: str):
+        """
+        Verify a token and return (user_id, token_id, expires) or None
+        """
+        if session_id is None or not isinstance(session_id, str):
+            return None
+        # Tokens are ASCII; compare_digest rejects other str anyway
+        if not session_id.isascii():
+            return None
+        payload, _, signature = session_id.partition('.')
+        if not payload or not signature:
+            return None
+        if not any(hmac.compare_digest(signature, self._sign(payload, key))
+                   for key in self.secrets):
+            return None
+        try:
+            user_id, issued, expires, token_id = \
+                _b64decode(payload).decode().split('|')
+            expires = int(expires)
+        except ValueError:
+            return None
+        # Tokens without an expiry are no longer issued nor accepted
+        if expires <= time.time():
+            return None
+        if token_id in self.revoked:
+            return None
+        return user_id, token_id, expires
+
+    def user_id_for_session_id(self, session_id: str = None) -> str:
+        """
+        Return the user ID carried by a valid token
+        """
+        claims = self._claims(session_id)
+        if claims is None:
+            return None
+        return claims[0]
+
+    def destroy_session(self, request=None) -> bool:
+        """
+        Revoke the token of the request until it expires
+        """
+        if request is None:
+            return False
+        claims = self._claims(self.session_cookie(request))
+        if claims is None:
+            return False
+        self.revoked.add(claims[1], claims[2])
+        return True
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the ASGI entry point against the threaded Flask server
+
+    $ python3 -m api.v1.bench_asgi --clients 64 --requests 640
+
+Starts each server in its own process, with an extra route that sleeps
+--delay seconds to stand for a slow client, password check or store
+write. Then CLIENTS concurrent keep-alive clients send REQUESTS requests
+to /api/v1/status and to the slow route. Reports requests/s and
+p50/p99 latency per server and route.
+
+The ASGI app is served by hypercorn, which must be installed.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import http.client
+import math
+import os
+import subprocess
+import sys
+import time
+
+
+SLOW_PATH = '/api/v1/bench/slow'
+
+
+def serve(server: str, port: int, delay: float) -> None:
+    """
+    Serve the API with the slow route added, on `server` (flask or asgi)
+    """
+    from api.v1.app import app
+
+    def slow():
+        time.sleep(delay)
+        return "ok"
+
+    app.add_url_rule(SLOW_PATH, 'bench_slow', slow)
+    if server == 'flask':
+        app.run(host='127.0.0.1', port=port, threaded=True)
+        return
+
+    import asyncio
+    from hypercorn.asyncio import serve as hypercorn_serve
+    from hypercorn.config import Config
+    from api.v1.asgi import asgi_app
+    config = Config()
+    config.bind = ['127.0.0.1:{}'.format(port)]
+    config.backlog = 1024
+    asyncio.run(hypercorn_serve(asgi_app, config))
+
+
+def wait_ready(port: int, timeout: float = 10) -> None:
+    """
+    Wait until the server on `port` answers
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/api/v1/status')
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def percentile(samples: list, p: float) -> float:
+    """
+    Nearest-rank percentile of sorted samples
+    """
+    return samples[max(0, math.ceil(p / 100 * len(samples)) - 1)]
+
+
+def load(port: int, path: str, clients: int, requests: int) -> dict:
+    """
+    Send `requests` GET requests from `clients` concurrent keep-alive
+    connections; return throughput and latency percentiles
+    """
+    per_client = max(1, requests // clients)
+
+    def client(_):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        latencies = []
+        for _ in range(per_client):
+            started = time.perf_counter()
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+            latencies.append(time.perf_counter() - started)
+            if response.status != 200:
+                raise RuntimeError("{} {}".format(path, response.status))
+        conn.close()
+        return latencies
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        latencies = sorted(sum(pool.map(client, range(clients)), []))
+    elapsed = time.perf_counter() - started
+    return {'rps': len(latencies) / elapsed,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000}
+
+
+def main() -> None:
+    """
+    Run the benchmark, or serve one app with --serve
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--requests', type=int, default=640)
+    parser.add_argument('--delay', type=float, default=0.05,
+                        help='seconds spent by the slow route')
+    parser.add_argument('--port', type=int, default=5091)
+    parser.add_argument('--serve', choices=['flask', 'asgi'],
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve, args.port, args.delay)
+        return
+
+    print("{:<6} {:<20} {:>9} {:>9} {:>9}".format(
+        'server', 'route', 'req/s', 'p50 ms', 'p99 ms'))
+    for server in ('flask', 'asgi'):
+        env = dict(os.environ)
+        env.pop('AUTH_TYPE', None)
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'api.v1.bench_asgi', '--serve', server,
+             '--port', str(args.port), '--delay', str(args.delay)],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_ready(args.port)
+            for path in ('/api/v1/status', SLOW_PATH):
+                stats = load(args.port, path, args.clients, args.requests)
+                print("{:<6} {:<20} {:>9.1f} {:>9.1f} {:>9.1f}".format(
+                    server, path, stats['rps'], stats['p50_ms'],
+                    stats['p99_ms']))
+        finally:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
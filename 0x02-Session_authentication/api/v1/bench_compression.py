@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Benchmark of response compression: bytes on the wire and CPU cost
+
+    $ python3 -m api.v1.bench_compression --users 10000
+
+Writes a .db_User.json of USERS users in a temporary directory and
+fetches /api/v1/users through the test client with each content coding
+(zstd only if zstandard is installed). Reports the body size and the
+wall and CPU milliseconds per request, compression included.
+"""
+from api.v1.bench_startup import write_store
+import argparse
+import os
+import tempfile
+import time
+
+
+def measure(client, encoding: str, requests: int) -> dict:
+    """
+    Fetch the user list `requests` times with one content coding
+    """
+    headers = {'Accept-Encoding': encoding}
+    response = client.get('/api/v1/users', headers=headers)
+    if response.headers.get('Content-Encoding', 'identity') != encoding:
+        raise RuntimeError("{} was not negotiated".format(encoding))
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    for _ in range(requests):
+        client.get('/api/v1/users', headers=headers)
+    return {'bytes': len(response.data),
+            'wall_ms': (time.perf_counter() - wall) / requests * 1000,
+            'cpu_ms': (time.process_time() - cpu) / requests * 1000}
+
+
+def main() -> None:
+    """
+    Run the benchmark for every content coding
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=20)
+    args = parser.parse_args()
+    os.environ.pop('AUTH_TYPE', None)
+
+    with tempfile.TemporaryDirectory() as directory:
+        write_store(directory, args.users)
+        os.chdir(directory)
+        from api.v1.app import app
+        from api.v1 import compression
+        encodings = ['identity', 'gzip', 'deflate']
+        if compression.zstandard is not None:
+            encodings.append('zstd')
+        client = app.test_client()
+        print("level {}, {} users".format(compression.LEVEL, args.users))
+        print("{:<10} {:>12} {:>8} {:>10} {:>10}".format(
+            'encoding', 'bytes', 'ratio', 'wall ms', 'cpu ms'))
+        identity = None
+        for encoding in encodings:
+            result = measure(client, encoding, args.requests)
+            identity = identity or result['bytes']
+            print("{:<10} {:>12} {:>8.2f} {:>10.1f} {:>10.1f}".format(
+                encoding, result['bytes'], result['bytes'] / identity,
+                result['wall_ms'], result['cpu_ms']))
+        os.chdir('/')
+
+
+if __name__ == '__main__':
+    main()
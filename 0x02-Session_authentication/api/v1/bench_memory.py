@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Memory benchmark of the pre-forking server: RSS and PSS per worker
+
+    $ python3 -m api.v1.bench_memory --users 100000 --workers 4
+
+Writes a .db_User.json of USERS users in a temporary directory and
+measures, from /proc/<pid>/smaps_rollup:
+
+- baseline: one process that imported the app and loaded the store,
+  i.e. what every worker would cost without sharing
+- started: the server parent and its workers right after the fork
+- warm: after REQUESTS reads of single users and of /api/v1/status
+- written: after one POST /api/v1/users and the same reads again, so
+  that every worker reloaded the User store
+- rolled: once the server replaced its workers STORE_ROLL_DELAY
+  seconds after the write, and after the same reads again
+
+RSS counts shared pages in full in every process; PSS splits them
+between the processes sharing them, so the PSS total is the real cost.
+"""
+from api.v1.bench_asgi import wait_ready
+from api.v1.bench_startup import write_store
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+
+BASELINE = """
+import sys, time
+from api.v1.app import app
+from models.user import User
+User.count()
+print('ready', flush=True)
+sys.stdin.read()
+"""
+
+
+def memory_kb(pid: int) -> dict:
+    """
+    Rss and Pss of a process in kB
+    """
+    values = {}
+    with open('/proc/{}/smaps_rollup'.format(pid)) as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            if name in ('Rss', 'Pss'):
+                values[name.lower()] = int(value.split()[0])
+    return values
+
+
+def children(pid: int) -> list:
+    """
+    PIDs of the child processes of a process
+    """
+    pids = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(entry)) as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The command name is in parentheses and may contain spaces
+        if int(stat.rsplit(')', 1)[1].split()[1]) == pid:
+            pids.append(int(entry))
+    return pids
+
+
+def read_users(port: int, user_ids: list, requests: int) -> None:
+    """
+    Send `requests` reads of random users and of the status route
+    """
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    for i in range(requests):
+        path = '/api/v1/status' if i % 2 else \
+            '/api/v1/users/' + random.choice(user_ids)
+        conn.request('GET', path, headers={'Connection': 'close'})
+        conn.getresponse().read()
+        conn.close()
+
+
+def create_user(port: int) -> None:
+    """
+    Save one new User through the API
+    """
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    conn.request('POST', '/api/v1/users', body=json.dumps(
+        {'email': 'new@hbtn.io', 'password': 'pwd'}),
+        headers={'Content-Type': 'application/json'})
+    response = conn.getresponse()
+    response.read()
+    if response.status != 201:
+        raise RuntimeError("POST /api/v1/users {}".format(response.status))
+
+
+def report(phase: str, parent: int, workers: list) -> None:
+    """
+    Print the memory of the server parent and its workers
+    """
+    usage = [memory_kb(pid) for pid in workers]
+    total = memory_kb(parent)['pss'] + sum(u['pss'] for u in usage)
+    print("{:<10} {:>8} {:>16} {:>16} {:>14}".format(
+        phase, len(workers),
+        sum(u['rss'] for u in usage) // len(usage) // 1024,
+        sum(u['pss'] for u in usage) // len(usage) // 1024,
+        total // 1024))
+
+
+def main() -> None:
+    """
+    Run the benchmark
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--port', type=int, default=5092)
+    parser.add_argument('--roll-delay', type=int, default=20,
+                        help='STORE_ROLL_DELAY of the server')
+    args = parser.parse_args()
+
+    project = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    with tempfile.TemporaryDirectory() as directory:
+        write_store(directory, args.users)
+        with open(os.path.join(directory, '.db_User.json')) as f:
+            user_ids = list(json.load(f))
+        env = dict(os.environ, PYTHONPATH=project, API_HOST='127.0.0.1',
+                   API_PORT=str(args.port), WORKERS=str(args.workers),
+                   STORE_ROLL_DELAY=str(args.roll_delay))
+        env.pop('AUTH_TYPE', None)
+
+        baseline = subprocess.Popen(
+            [sys.executable, '-c', BASELINE], cwd=directory, env=env,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        baseline.stdout.readline()
+        print("baseline: one process holding the store: {} MB RSS".format(
+            memory_kb(baseline.pid)['rss'] // 1024))
+        baseline.communicate()
+
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'api.v1.serve'], cwd=directory, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_ready(args.port, timeout=60)
+            while len(children(server.pid)) < args.workers:
+                time.sleep(0.1)
+            workers = children(server.pid)
+            print("{:<10} {:>8} {:>16} {:>16} {:>14}".format(
+                'phase', 'workers', 'RSS/worker MB', 'PSS/worker MB',
+                'total PSS MB'))
+            report('started', server.pid, workers)
+            read_users(args.port, user_ids, args.requests)
+            report('warm', server.pid, workers)
+            written = time.monotonic()
+            create_user(args.port)
+            read_users(args.port, user_ids, args.requests)
+            if time.monotonic() - written >= args.roll_delay:
+                raise RuntimeError("reads outlasted --roll-delay")
+            report('written', server.pid, workers)
+            old_workers = set(workers)
+            while True:
+                workers = children(server.pid)
+                if len(workers) == args.workers and \
+                        not old_workers & set(workers):
+                    break
+                time.sleep(0.1)
+            read_users(args.port, user_ids, args.requests)
+            report('rolled', server.pid, workers)
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Benchmark of SessionDBAuth session validation
+
+    $ python3 -m api.v1.bench_sessions --sessions 10000
+
+Writes SESSIONS sessions to a store under a temporary directory, then
+times user_id_for_session_id() on a cache miss read from the store, on
+a cache hit and on an unknown session ID (negative cache hit). Exits
+with status 1 if a cache hit takes more than SESSION_HIT_BUDGET_US
+microseconds (default 50).
+"""
+from api.v1.auth.session_db_auth import SessionDBAuth
+from models.base import DATA
+from models.user_session import UserSession
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+
+def per_call_us(func, session_ids: list) -> float:
+    """
+    Microseconds per call of func over session_ids
+    """
+    started = time.perf_counter()
+    for session_id in session_ids:
+        func(session_id)
+    return (time.perf_counter() - started) / len(session_ids) * 1e6
+
+
+def main() -> None:
+    """
+    Run the benchmark
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sessions', type=int, default=10000)
+    parser.add_argument('--lookups', type=int, default=100000)
+    args = parser.parse_args()
+    try:
+        budget = float(os.getenv('SESSION_HIT_BUDGET_US', 50))
+    except ValueError:
+        budget = 50
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        UserSession._ensure_loaded()
+        sessions = [UserSession(id="session-{}".format(i),
+                                user_id="user-{}".format(i),
+                                session_id="session-{}".format(i))
+                    for i in range(args.sessions)]
+        DATA['UserSession'] = {s.id: s for s in sessions}
+        UserSession.save_to_file()
+        session_ids = list(DATA['UserSession'])
+        hits = random.choices(session_ids, k=args.lookups)
+        unknown = ["unknown-{}".format(i % 100) for i in range(args.lookups)]
+
+        auth = SessionDBAuth()
+        results = {}
+        # The first lookup of each session reads it from the store
+        results['miss'] = per_call_us(auth.user_id_for_session_id,
+                                      session_ids)
+        results['hit'] = per_call_us(auth.user_id_for_session_id, hits)
+        results['unknown'] = per_call_us(auth.user_id_for_session_id,
+                                         unknown)
+        os.chdir('/')
+
+    print("{:<10} {:>10}".format('lookup', 'us/call'))
+    for name, us in results.items():
+        print("{:<10} {:>10.2f}".format(name, us))
+    print("cache hit budget: {:.0f} us".format(budget))
+    if results['hit'] > budget:
+        print("over budget")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
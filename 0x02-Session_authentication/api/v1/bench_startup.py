@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark: time to the first served /api/v1/status as the User
+store grows
+
+    $ python3 -m api.v1.bench_startup --sizes 0,10000,100000
+
+For each size, writes a .db_User.json of that many users in a temporary
+directory and starts a fresh interpreter there with `-X importtime`. The
+child imports api.v1.app, serves /api/v1/status then /api/v1/users/
+through the test client, and reports when each answered. Reports the
+cumulative import time of api.v1.app (from -X importtime), the part of
+it spent importing Flask and the rest (our own modules), the time from
+process start to the first status response, and to the first request
+that needs the store.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+
+CHILD = """
+import time
+from api.v1.app import app
+client = app.test_client()
+assert client.get('/api/v1/status').status_code == 200
+print('status', time.time(), flush=True)
+assert client.get('/api/v1/users/').status_code == 200
+print('users', time.time(), flush=True)
+"""
+
+
+def write_store(directory: str, size: int) -> None:
+    """
+    Write a User store of `size` users in `directory`
+    """
+    users = {}
+    for i in range(size):
+        user_id = str(uuid.uuid4())
+        users[user_id] = {
+            "id": user_id, "created_at": "2024-02-24T11:09:14",
+            "updated_at": "2024-02-24T11:09:14",
+            "email": "user{}@hbtn.io".format(i),
+            "_password": "0" * 64, "first_name": None, "last_name": None}
+    with open(os.path.join(directory, ".db_User.json"), "w") as f:
+        json.dump(users, f)
+
+
+def import_time_ms(stderr: str, module: str) -> float:
+    """
+    Cumulative import time of `module` from -X importtime output
+    """
+    for line in stderr.splitlines():
+        parts = [part.strip() for part in line.split('|')]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1]) / 1000
+    return float('nan')
+
+
+def measure(size: int) -> dict:
+    """
+    Start the app on a store of `size` users and time its first requests
+    """
+    project = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    with tempfile.TemporaryDirectory() as directory:
+        write_store(directory, size)
+        env = dict(os.environ, PYTHONPATH=project)
+        env.pop('AUTH_TYPE', None)
+        env.pop('STORE_WARMUP', None)
+        started = time.time()
+        child = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', CHILD],
+            cwd=directory, env=env, capture_output=True, text=True,
+            check=True)
+    times = dict(line.split() for line in child.stdout.splitlines())
+    return {'size': size,
+            'import_ms': import_time_ms(child.stderr, 'api.v1.app'),
+            'flask_ms': import_time_ms(child.stderr, 'flask'),
+            'status_ms': (float(times['status']) - started) * 1000,
+            'users_ms': (float(times['users']) - started) * 1000}
+
+
+def main() -> None:
+    """
+    Run the benchmark for every size
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', default='0,10000,100000',
+                        help='comma-separated store sizes')
+    args = parser.parse_args()
+    print("{:>8} {:>10} {:>10} {:>10} {:>10} {:>15}".format(
+        'users', 'import ms', 'flask ms', 'own ms', 'status ms',
+        'first users ms'))
+    for size in (int(s) for s in args.sizes.split(',')):
+        result = measure(size)
+        print("{:>8} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f} {:>15.1f}".format(
+            result['size'], result['import_ms'], result['flask_ms'],
+            result['import_ms'] - result['flask_ms'], result['status_ms'],
+            result['users_ms']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Response compression module, enabled in the app unless COMPRESS=0
+"""
+from os import getenv
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+SKIPPED_STATUS = (204, 304, 401, 403, 404)
+ENCODINGS = ('zstd', 'gzip', 'deflate')
+
+
+def _int_env(name: str, default: int) -> int:
+    """
+    Integer environment variable with a fallback
+    """
+    try:
+        return int(getenv(name, default))
+    except ValueError:
+        return default
+
+
+MIN_SIZE = _int_env('COMPRESS_MIN_SIZE', 500)
+LEVEL = _int_env('COMPRESS_LEVEL', 6)
+
+
+def _compressor(encoding: str):
+    """
+    Incremental compressor object for a content coding
+    """
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=LEVEL).compressobj()
+    wbits = 31 if encoding == 'gzip' else 15
+    return zlib.compressobj(LEVEL, zlib.DEFLATED, wbits)
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """
+    ETag of the `encoding` coded representation of a response whose
+    identity representation has ETag `etag`
+    """
+    return "{}-{}".format(etag, encoding)
+
+
+def etag_variants(etag: str) -> list:
+    """
+    ETags of every representation of a response with ETag `etag`
+    """
+    return [etag] + [encoded_etag(etag, encoding) for encoding in ENCODINGS]
+
+
+def _negotiate(request) -> str:
+    """
+    Pick the best content coding the client accepts
+    """
+    candidates = ['gzip', 'deflate']
+    if zstandard is not None:
+        candidates.insert(0, 'zstd')
+    return request.accept_encodings.best_match(candidates)
+
+
+def _stream(chunks, compressor):
+    """
+    Compress an iterable of chunks as it is consumed
+    """
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def compress_response(response, request):
+    """
+    Compress a response body according to the request Accept-Encoding.
+
+    Buffered bodies below COMPRESS_MIN_SIZE bytes and error bodies are
+    sent as is; streamed bodies are compressed chunk by chunk. The ETag
+    of a compressed response gets the content coding appended.
+    """
+    if response.status_code in SKIPPED_STATUS or \
+            response.direct_passthrough or \
+            'Content-Encoding' in response.headers:
+        return response
+    if not response.is_streamed and \
+            response.calculate_content_length() < MIN_SIZE:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = _negotiate(request)
+    if encoding is None:
+        return response
+
+    compressor = _compressor(encoding)
+    if response.is_streamed:
+        response.response = _stream(response.response, compressor)
+        response.headers.pop('Content-Length', None)
+    else:
+        response.set_data(compressor.compress(response.get_data()) +
+                          compressor.flush())
+    response.headers['Content-Encoding'] = encoding
+
+    # The compressed bytes differ from the identity ones: a strong ETag
+    # must identify them, see etag_variants()
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(encoded_etag(etag, encoding), weak)
+    return response
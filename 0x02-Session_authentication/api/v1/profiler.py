@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Sampling request profiler module
+
+Enabled with PROFILE_SAMPLE_RATE=N: one request in N is profiled by a
+stack sampler thread and its stacks are written in the collapsed format
+used by flamegraph tools (one "frame;frame;frame count" line per stack).
+
+- PROFILE_SLOW_MS: only keep profiles of requests slower than this
+- PROFILE_INTERVAL_MS: sampling interval (default 5)
+- PROFILE_DIR: output directory (default "profiles")
+- PROFILE_MAX_FILES / PROFILE_MAX_BYTES: oldest profiles are deleted
+  past these limits (default 100 files, 10 MB)
+
+At most one request is profiled at a time, which bounds the overhead to
+a single sampler thread.
+"""
+from collections import Counter
+from os import getenv, path
+import itertools
+import os
+import re
+import sys
+import threading
+import time
+
+
+def _int_env(name: str, default: int) -> int:
+    """
+    Integer environment variable with a fallback
+    """
+    try:
+        return int(getenv(name, default))
+    except ValueError:
+        return default
+
+
+SAMPLE_RATE = _int_env('PROFILE_SAMPLE_RATE', 0)
+SLOW_MS = _int_env('PROFILE_SLOW_MS', 0)
+INTERVAL = _int_env('PROFILE_INTERVAL_MS', 5) / 1000
+PROFILE_DIR = getenv('PROFILE_DIR', 'profiles')
+MAX_FILES = _int_env('PROFILE_MAX_FILES', 100)
+MAX_BYTES = _int_env('PROFILE_MAX_BYTES', 10 * 1024 * 1024)
+
+_requests = itertools.count()
+_busy = threading.Lock()
+
+
+class StackSampler(threading.Thread):
+    """
+    Thread sampling the stack of another thread at a fixed interval
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        """
+        Prepare a sampler for the thread `thread_id`
+        """
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.started_at = time.perf_counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        """
+        Sample until stopped
+        """
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append("{} ({}:{})".format(
+                    code.co_name, path.basename(code.co_filename),
+                    code.co_firstlineno))
+                frame = frame.f_back
+            if frames:
+                self.stacks[';'.join(reversed(frames))] += 1
+
+    def stop(self) -> float:
+        """
+        Stop sampling and return the elapsed time in seconds
+        """
+        self._stop_event.set()
+        self.join()
+        return time.perf_counter() - self.started_at
+
+
+def start():
+    """
+    Start profiling the current request if it is sampled; return the
+    sampler or None
+    """
+    if SAMPLE_RATE <= 0 or next(_requests) % SAMPLE_RATE:
+        return None
+    if not _busy.acquire(blocking=False):
+        return None
+    sampler = StackSampler(threading.get_ident(), INTERVAL)
+    sampler.start()
+    return sampler
+
+
+def stop(sampler, method: str, route: str) -> None:
+    """
+    Stop a sampler started by start() and write its profile
+    """
+    try:
+        elapsed = sampler.stop()
+        if elapsed * 1000 < SLOW_MS or not sampler.stacks:
+            return
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        name = "{}-{}-{}.collapsed".format(
+            time.time_ns(), method, re.sub(r'[^A-Za-z0-9]+', '_', route))
+        with open(path.join(PROFILE_DIR, name), 'w') as f:
+            for stack, count in sampler.stacks.items():
+                f.write("{} {}\n".format(stack, count))
+        _rotate()
+    finally:
+        _busy.release()
+
+
+def _rotate() -> None:
+    """
+    Delete the oldest profiles past MAX_FILES or MAX_BYTES
+    """
+    entries = []
+    for name in os.listdir(PROFILE_DIR):
+        if name.endswith('.collapsed'):
+            st = os.stat(path.join(PROFILE_DIR, name))
+            entries.append((st.st_mtime_ns, st.st_size, name))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    while entries and (len(entries) > MAX_FILES or total > MAX_BYTES):
+        _, size, name = entries.pop(0)
+        os.remove(path.join(PROFILE_DIR, name))
+        total -= size
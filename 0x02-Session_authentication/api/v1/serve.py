@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Pre-forking production server for the API
+
+    $ API_HOST=0.0.0.0 API_PORT=5000 WORKERS=4 python3 -m api.v1.serve
+
+The parent process loads the User store once, freezes it out of the
+garbage collector so that the pages stay shared copy-on-write, binds
+the listening socket and forks WORKERS processes serving from it.
+
+- WORKERS: number of worker processes (default: CPU count)
+- MAX_REQUESTS: a worker exits and is replaced after serving this many
+  requests (default 0, never)
+- SIGHUP: reload the store and replace the workers one by one, each
+  new worker being forked before the next old one is stopped
+- STORE_ROLL_DELAY: once the User store file was written and then left
+  unchanged for this many seconds, do the same as SIGHUP (default 5,
+  0 to never do it)
+- SIGTERM / SIGINT: let the workers finish their request and stop
+
+Writes take a lock file per class and reload the store first if
+another worker changed it, and every request starts by reloading the
+stores whose file changed (one stat() per store), so no write is lost.
+A worker that reloaded holds a private copy of the store, which is why
+the parent reloads it too and rolls the workers once writes settle:
+the new workers share the parent's copy again.
+`python3 -m api.v1.bench_memory` measures RSS and PSS per worker.
+
+Sessions of session_auth live in each worker's memory; use
+session_db_auth or signed_session with more than one worker.
+"""
+from os import getenv
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+
+def _int_env(name: str, default: int) -> int:
+    """
+    Integer environment variable with a fallback
+    """
+    try:
+        return int(getenv(name, default))
+    except ValueError:
+        return default
+
+
+def _bind(host: str, port: int) -> socket.socket:
+    """
+    Listening socket shared by all the workers
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, 'SO_REUSEPORT'):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _load_store() -> None:
+    """
+    Load the store in the parent and keep it out of future collections
+    """
+    from models.user import User
+    User.load_from_file()
+    gc.collect()
+    gc.freeze()
+
+
+def _store_changed(pending: dict, delay: int) -> bool:
+    """
+    Whether the User store file changed since the parent loaded it and
+    then stayed the same for `delay` seconds
+    """
+    from models.base import FILE_VERSIONS
+    from models.user import User
+    version = User._current_version()
+    if delay <= 0 or version == FILE_VERSIONS.get('User'):
+        pending.clear()
+        return False
+    now = time.monotonic()
+    if pending.get('version') != version:
+        pending['version'] = version
+        pending['since'] = now
+        return False
+    return now - pending['since'] >= delay
+
+
+def _worker(app, sock: socket.socket, max_requests: int) -> None:
+    """
+    Serve requests from the shared socket until told to stop
+    """
+    from werkzeug.serving import make_server
+
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *args: stopping.append(True))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_DFL)
+
+    host, port = sock.getsockname()[:2]
+    server = make_server(host, port, app, fd=sock.fileno())
+    server.timeout = 1
+    served = 0
+    while not stopping:
+        server.handle_request()
+        served += 1
+        if max_requests and served >= max_requests:
+            break
+    os._exit(0)
+
+
+def serve(host: str, port: int, workers: int, max_requests: int,
+          roll_delay: int = 0) -> None:
+    """
+    Fork the workers and keep their number constant until stopped
+    """
+    from api.v1.app import app
+
+    sock = _bind(host, port)
+    _load_store()
+    children = set()
+    state = {'stopping': False, 'reload': False}
+    # Workers forked before the last reload, replaced one at a time
+    retiring = []
+    replacing = None
+    pending = {}
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            _worker(app, sock, max_requests)
+        children.add(pid)
+
+    def on_stop(*args):
+        state['stopping'] = True
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    def on_reload(*args):
+        state['reload'] = True
+
+    signal.signal(signal.SIGTERM, on_stop)
+    signal.signal(signal.SIGINT, on_stop)
+    signal.signal(signal.SIGHUP, on_reload)
+
+    for _ in range(workers):
+        spawn()
+    # os.wait() would be resumed after a signal handler (PEP 475) and
+    # only return when a worker exits, so poll instead
+    while children:
+        if not retiring and replacing is None and \
+                _store_changed(pending, roll_delay):
+            state['reload'] = True
+        if state['reload'] and not state['stopping']:
+            state['reload'] = False
+            gc.unfreeze()
+            _load_store()
+            retiring = [pid for pid in children if pid != replacing]
+        while True:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0
+            if pid == 0:
+                break
+            children.discard(pid)
+            if pid == replacing:
+                replacing = None
+            if not state['stopping']:
+                spawn()
+        if replacing is None and retiring and not state['stopping']:
+            replacing = retiring.pop(0)
+            if replacing in children:
+                os.kill(replacing, signal.SIGTERM)
+            else:
+                replacing = None
+        time.sleep(0.1)
+    sock.close()
+
+
+if __name__ == "__main__":
+    serve(getenv("API_HOST", "0.0.0.0"),
+          _int_env("API_PORT", 5000),
+          _int_env("WORKERS", os.cpu_count() or 1),
+          _int_env("MAX_REQUESTS", 0),
+          _int_env("STORE_ROLL_DELAY", 5))
+    sys.exit(0)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Token bucket rate limiting module
+"""
+
+from collections import OrderedDict
+import math
+import os
+import threading
+import time
+
+
+class TokenBucketLimiter:
+    """
+    Token buckets keyed by an arbitrary string (client IP, email...).
+
+    Each key gets `burst` tokens refilled at `rate` tokens per second.
+    Buckets are kept in least recently used order, so every operation
+    is O(1) amortised: the least recently used buckets are dropped once
+    they are full again, since a full bucket and a missing one behave
+    the same, and when `max_keys` buckets are tracked the least recently
+    used one is evicted to make room for a new key. New keys are never
+    refused for lack of room, so spraying keys cannot lock anybody out;
+    it can only reset the limit of the idlest keys, and the per-IP
+    limiter bounds how fast one client can spray.
+    """
+
+    def __init__(self, burst: float, rate: float, max_keys: int = 10000):
+        """
+        Initialise an empty limiter
+        """
+        self.burst = burst
+        self.rate = rate
+        self.max_keys = max_keys
+        self.throttled = 0
+        self.evicted = 0
+        # key -> [tokens, last update], least recently used first
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _drop_refilled(self, now: float) -> None:
+        """
+        Forget the least recently used buckets that are full again
+        """
+        while self._buckets:
+            key, (tokens, last) = next(iter(self._buckets.items()))
+            if tokens + (now - last) * self.rate < self.burst:
+                return
+            self._buckets.popitem(last=False)
+
+    def consume(self, key: str) -> float:
+        """
+        Take one token for `key`; return 0 if allowed, otherwise the
+        number of seconds until a token is available
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._drop_refilled(now)
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    self._buckets.popitem(last=False)
+                    self.evicted += 1
+                bucket = [self.burst, now]
+                self._buckets[key] = bucket
+            else:
+                bucket[0] = min(self.burst,
+                                bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+                self._buckets.move_to_end(key)
+
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0
+            self.throttled += 1
+            if self.rate <= 0:
+                return math.inf
+            return (1 - bucket[0]) / self.rate
+
+
+def _limiter_from_env(prefix: str, burst: float, rate: float):
+    """
+    Build a limiter configured by <prefix>_BURST and <prefix>_RATE
+    """
+    try:
+        return TokenBucketLimiter(
+            float(os.getenv(prefix + '_BURST', burst)),
+            float(os.getenv(prefix + '_RATE', rate)),
+            int(os.getenv('THROTTLE_MAX_KEYS', 10000)))
+    except ValueError:
+        return TokenBucketLimiter(burst, rate)
+
+
+login_by_ip = _limiter_from_env('THROTTLE_IP', 20, 1)
+login_by_email = _limiter_from_env('THROTTLE_EMAIL', 5, 0.1)
+
+
+def login_retry_after(ip: str, email: str) -> int:
+    """
+    Consume login tokens for an IP and an email; return 0 if the attempt
+    may proceed, otherwise the Retry-After delay in whole seconds
+    """
+    wait = max(login_by_ip.consume(ip), login_by_email.consume(email))
+    if wait == 0:
+        return 0
+    if wait == math.inf:
+        return 3600
+    return max(1, math.ceil(wait))
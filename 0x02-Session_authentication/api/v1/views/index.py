@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
 """ Module of Index views
 """
-from flask import jsonify, abort
+from flask import Response, jsonify, abort
 from api.v1.views import app_views
+from api.v1.throttle import login_by_ip, login_by_email
 
 
 @app_views.route('/status', methods=['GET'], strict_slashes=False)
@@ -21,11 +22,27 @@ def stats() -> str:
       - the number of each objects
     """
     from models.user import User
+    from api.v1.app import auth
     stats = {}
     stats['users'] = User.count()
+    if hasattr(auth, 'session_stats'):
+        stats['sessions'] = auth.session_stats()
+    stats['login_throttled'] = {'ip': login_by_ip.throttled,
+                                'email': login_by_email.throttled}
     return jsonify(stats)
 
 
+@app_views.route('/metrics/', strict_slashes=False)
+def metrics() -> str:
+    """ GET /api/v1/metrics
+    Return:
+      - latency histograms and store counters in Prometheus text format
+    """
+    from api.v1.metrics import render
+    return Response(render(),
+                    mimetype='text/plain; version=0.0.4')
+
+
 @app_views.route('/unauthorized/', strict_slashes=False)
 def unathorized() -> str:
     """
@@ -4,6 +4,7 @@ Session authentication views module
 """
 
 from api.v1.views import app_views
+from api.v1.throttle import login_retry_after
 from models.user import User
 from flask import jsonify, request, abort
 import os
@@ -22,6 +23,11 @@ def login():
         return jsonify({"error": "email missing"}), 400
     if not password:
         return jsonify({"error": "password missing"}), 400
+    retry_after = login_retry_after(request.remote_addr, email)
+    if retry_after:
+        response = jsonify({"error": "too many requests"})
+        response.headers['Retry-After'] = str(retry_after)
+        return response, 429
     user = User.search({'email': email})
     if not user:
         return jsonify({"error": "no user found for this email"}), 404
@@ -1,9 +1,47 @@
 #!/usr/bin/env python3
 """ Module of Users views
 """
+from api.v1.compression import etag_variants
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+from flask import abort, jsonify, make_response, request
 from models.user import User
+import hashlib
+
+
+def _user_etag(user: User) -> str:
+    """ Strong ETag of a User, derived from its id and its version,
+    which is saved with it and increases on every save
+    """
+    version = "{}:{}".format(user.id, user.version)
+    return hashlib.sha1(version.encode()).hexdigest()
+
+
+def _none_match(etag: str) -> str:
+    """ The representation ETag of If-None-Match matching etag (weak
+    comparison), or None
+    """
+    for tag in etag_variants(etag):
+        if request.if_none_match.contains_weak(tag):
+            return tag
+    return None
+
+
+def _match_fails(etag: str) -> bool:
+    """ Whether the request has an If-Match without any representation
+    ETag of etag (strong comparison, RFC 7232)
+    """
+    if not request.if_match:
+        return False
+    return not any(request.if_match.contains(tag)
+                   for tag in etag_variants(etag))
+
+
+def _not_modified(etag: str):
+    """ Empty 304 response carrying the ETag
+    """
+    response = make_response('', 304)
+    response.set_etag(etag)
+    return response
 
 
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
@@ -11,9 +49,16 @@ def view_all_users() -> str:
     """ GET /api/v1/users
     Return:
       - list of all User objects JSON represented
+      - 304 if If-None-Match matches the current ETag
     """
+    etag = User.generation()
+    matched = _none_match(etag)
+    if matched:
+        return _not_modified(matched)
     all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    response = jsonify(all_users)
+    response.set_etag(etag)
+    return response
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
@@ -23,6 +68,7 @@ def view_one_user(user_id: str = None) -> str:
       - User ID
     Return:
       - User object JSON represented
+      - 304 if If-None-Match matches the User ETag
       - 404 if the User ID doesn't exist
     """
     if user_id is None:
@@ -35,7 +81,13 @@ def view_one_user(user_id: str = None) -> str:
         user = User.get(user_id)
         if user is None:
             abort(404)
-    return jsonify(user.to_json())
+    etag = _user_etag(user)
+    matched = _none_match(etag)
+    if matched:
+        return _not_modified(matched)
+    response = jsonify(user.to_json())
+    response.set_etag(etag)
+    return response
 
 
 @app_views.route('/users/<user_id>', methods=['DELETE'], strict_slashes=False)
@@ -46,12 +98,15 @@ def delete_user(user_id: str = None) -> str:
     Return:
       - empty JSON is the User has been correctly deleted
       - 404 if the User ID doesn't exist
+      - 412 if If-Match doesn't match the User ETag
     """
     if user_id is None:
         abort(404)
     user = User.get(user_id)
     if user is None:
         abort(404)
+    if _match_fails(_user_etag(user)):
+        abort(412)
     user.remove()
     return jsonify({}), 200
 
@@ -106,12 +161,15 @@ def update_user(user_id: str = None) -> str:
       - User object JSON represented
       - 404 if the User ID doesn't exist
       - 400 if can't update the User
+      - 412 if If-Match doesn't match the User ETag
     """
     if user_id is None:
         abort(404)
     user = User.get(user_id)
     if user is None:
         abort(404)
+    if _match_fails(_user_etag(user)):
+        abort(412)
     rj = None
     try:
         rj = request.get_json()
@@ -124,4 +182,6 @@ def update_user(user_id: str = None) -> str:
     if rj.get('last_name') is not None:
         user.last_name = rj.get('last_name')
     user.save()
-    return jsonify(user.to_json()), 200
+    response = jsonify(user.to_json())
+    response.set_etag(_user_etag(user))
+    return response, 200
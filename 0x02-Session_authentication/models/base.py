@@ -1,15 +1,45 @@
 #!/usr/bin/env python3
 """ Base module
 """
+from contextlib import contextmanager
 from datetime import datetime
 from typing import TypeVar, List, Iterable
 from os import path
+import fcntl
 import json
+import os
+import threading
 import uuid
 
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
 DATA = {}
+LOADED = set()
+LOAD_LOCK = threading.Lock()
+STATS = {'search': 0, 'save': 0, 'remove': 0, 'file_write': 0,
+         'file_write_bytes': 0}
+GENERATIONS = {}
+# Class name -> (inode, mtime, size) of the store file last loaded or
+# written by this process; a different version was written by another one
+FILE_VERSIONS = {}
+GENERATION_PREFIX = uuid.uuid4().hex[:8]
+# Class name -> class, for every store loaded by this process
+CLASSES = {}
+
+
+def _file_version(st: os.stat_result) -> tuple:
+    """ Identify a version of a store file; files are replaced, never
+    rewritten in place
+    """
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def reload_changed() -> None:
+    """ Reload the stores another process wrote since this one loaded or
+    wrote them; called once per request, not on every access
+    """
+    for cls in list(CLASSES.values()):
+        cls._reload_if_changed()
 
 
 class Base():
@@ -34,6 +64,13 @@ class Base():
                                                 TIMESTAMP_FORMAT)
         else:
             self.updated_at = datetime.utcnow()
+        self._version = kwargs.get('_version', 0)
+
+    @property
+    def version(self) -> int:
+        """ Number of times the object was saved, kept in the file
+        """
+        return self._version
 
     def __eq__(self, other: TypeVar('Base')) -> bool:
         """ Equality
@@ -63,14 +100,66 @@ class Base():
         """
         s_class = cls.__name__
         file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
-        if not path.exists(file_path):
+        objs = {}
+        version = None
+        if path.exists(file_path):
+            with open(file_path, 'r') as f:
+                version = _file_version(os.fstat(f.fileno()))
+                objs_json = json.load(f)
+                for obj_id, obj_json in objs_json.items():
+                    objs[obj_id] = cls(**obj_json)
+        DATA[s_class] = objs
+        FILE_VERSIONS[s_class] = version
+        CLASSES[s_class] = cls
+        LOADED.add(s_class)
+        cls._bump_generation()
+
+    @classmethod
+    def _ensure_loaded(cls):
+        """ Load all objects from file on first access
+        """
+        s_class = cls.__name__
+        if s_class in LOADED:
             return
+        with LOAD_LOCK:
+            if s_class not in LOADED:
+                cls.load_from_file()
+
+    @classmethod
+    def _reload_if_changed(cls):
+        """ Load all objects from file again if another process wrote it
+        """
+        s_class = cls.__name__
+        if s_class not in LOADED or \
+                FILE_VERSIONS.get(s_class) == cls._current_version():
+            return
+        with LOAD_LOCK:
+            if FILE_VERSIONS.get(s_class) != cls._current_version():
+                cls.load_from_file()
+
+    @classmethod
+    def _current_version(cls):
+        """ Version of the store file on disk, None if there is none
+        """
+        try:
+            return _file_version(os.stat(".db_{}.json".format(cls.__name__)))
+        except OSError:
+            return None
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+    @classmethod
+    @contextmanager
+    def _write_lock(cls):
+        """ Serialise writes to the store file across threads and
+        processes; the store is reloaded first if another one wrote it
+        """
+        with open(".db_{}.json.lock".format(cls.__name__), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                cls._ensure_loaded()
+                cls._reload_if_changed()
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
 
     @classmethod
     def save_to_file(cls):
@@ -82,29 +171,81 @@ class Base():
         for obj_id, obj in DATA[s_class].items():
             objs_json[obj_id] = obj.to_json(True)
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+        content = json.dumps(objs_json)
+        # Readers in other processes see either the old or the new file,
+        # never a truncated one
+        tmp_path = "{}.{}.{}.tmp".format(file_path, os.getpid(),
+                                         threading.get_ident())
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, file_path)
+        FILE_VERSIONS[s_class] = _file_version(os.stat(file_path))
+        STATS['file_write'] += 1
+        STATS['file_write_bytes'] += len(content)
 
     def save(self):
         """ Save current object
         """
         s_class = self.__class__.__name__
+        STATS['save'] += 1
         self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        with self.__class__._write_lock():
+            # Another process may have saved it since it was read
+            stored = DATA[s_class].get(self.id)
+            self._version = max(self._version,
+                                getattr(stored, '_version', 0)) + 1
+            DATA[s_class][self.id] = self
+            self.__class__._bump_generation()
+            self.__class__.save_to_file()
 
     def remove(self):
         """ Remove object
         """
         s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        STATS['remove'] += 1
+        with self.__class__._write_lock():
+            if DATA[s_class].get(self.id) is not None:
+                del DATA[s_class][self.id]
+                self.__class__._bump_generation()
+                self.__class__.save_to_file()
+
+    @classmethod
+    def remove_where(cls, predicate) -> int:
+        """ Remove every object matching predicate with one file write;
+        return how many were removed
+        """
+        s_class = cls.__name__
+        STATS['remove'] += 1
+        with cls._write_lock():
+            ids = [obj_id for obj_id, obj in DATA[s_class].items()
+                   if predicate(obj)]
+            for obj_id in ids:
+                del DATA[s_class][obj_id]
+            if ids:
+                cls._bump_generation()
+                cls.save_to_file()
+        return len(ids)
+
+    @classmethod
+    def _bump_generation(cls):
+        """ Record that the objects of this class changed
+        """
+        s_class = cls.__name__
+        GENERATIONS[s_class] = GENERATIONS.get(s_class, 0) + 1
+
+    @classmethod
+    def generation(cls) -> str:
+        """ Token that changes whenever any object of this class changes
+        """
+        cls._ensure_loaded()
+        s_class = cls.__name__
+        return "{}-{}".format(GENERATION_PREFIX, GENERATIONS.get(s_class, 0))
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
+        cls._ensure_loaded()
         s_class = cls.__name__
         return len(DATA[s_class].keys())
 
@@ -118,6 +259,7 @@ class Base():
     def get(cls, id: str) -> TypeVar('Base'):
         """ Return one object by ID
         """
+        cls._ensure_loaded()
         s_class = cls.__name__
         return DATA[s_class].get(id)
 
@@ -125,7 +267,9 @@ class Base():
     def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
         """
+        cls._ensure_loaded()
         s_class = cls.__name__
+        STATS['search'] += 1
         def _search(obj):
             if len(attributes) == 0:
                 return True
@@ -0,0 +1,516 @@
+#!/usr/bin/env python3
+"""
+Tests of the API authentication and of its session stores
+"""
+import asyncio
+import base64
+import json
+import os
+import pytest
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import api.v1.app as app_module
+import models.base
+from api.v1.asgi import WsgiToAsgi, asgi_app
+from api.v1.auth.basic_auth import BasicAuth
+from api.v1.auth.session_auth import SessionAuth
+from api.v1.auth.session_db_auth import SessionDBAuth
+from api.v1.auth.session_exp_auth import SessionExpAuth
+from api.v1.throttle import TokenBucketLimiter
+from api.v1.auth.signed_session_auth import (REVOCATION_FILE,
+                                             RevocationList,
+                                             SignedSessionAuth)
+from models.user import User
+from models.user_session import UserSession
+
+
+@pytest.fixture
+def user(tmp_path, monkeypatch):
+    """ A saved User in an empty store under tmp_path
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(models.base, "DATA", {})
+    monkeypatch.setattr(models.base, "LOADED", set())
+    user = User(email="bob@hbtn.io")
+    user.password = "H0lberton"
+    user.save()
+    return user
+
+
+def count_calls(monkeypatch, cls, name):
+    """ Wrap cls.name to count its calls; return the counter
+    """
+    calls = []
+    original = getattr(cls, name)
+
+    def wrapper(*args, **kwargs):
+        calls.append(args)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(cls, name, wrapper)
+    return calls
+
+
+def test_basic_auth_verifies_credentials_once(user, monkeypatch):
+    """ One password check per request, whatever the outcome
+    """
+    monkeypatch.setattr(app_module, "auth", BasicAuth())
+    checks = count_calls(monkeypatch, User, "is_valid_password")
+    client = app_module.app.test_client()
+
+    good = base64.b64encode(b"bob@hbtn.io:H0lberton").decode()
+    response = client.get("/api/v1/users/me",
+                          headers={"Authorization": "Basic " + good})
+    assert response.status_code == 200
+    assert len(checks) == 1
+
+    bad = base64.b64encode(b"bob@hbtn.io:wrong").decode()
+    response = client.get("/api/v1/users/me",
+                          headers={"Authorization": "Basic " + bad})
+    assert response.status_code == 403
+    assert len(checks) == 2
+
+    response = client.get("/api/v1/users/me")
+    assert response.status_code == 401
+    assert len(checks) == 2
+
+
+def test_session_auth_looks_session_up_once(user, monkeypatch):
+    """ One session lookup per request, whatever the outcome
+    """
+    monkeypatch.setenv("SESSION_NAME", "_my_session_id")
+    auth = SessionAuth()
+    monkeypatch.setattr(app_module, "auth", auth)
+    session_id = auth.create_session(user.id)
+    lookups = count_calls(monkeypatch, SessionAuth, "user_id_for_session_id")
+    client = app_module.app.test_client()
+
+    client.set_cookie("_my_session_id", session_id)
+    assert client.get("/api/v1/users/me").status_code == 200
+    assert len(lookups) == 1
+
+    client.set_cookie("_my_session_id", "unknown")
+    assert client.get("/api/v1/users/me").status_code == 403
+    assert len(lookups) == 2
+
+
+def test_session_expiry_is_shared_between_instances(monkeypatch):
+    """ A session created through one instance expires through another,
+    as with the views' re-imported `api.v1.app.auth`
+    """
+    monkeypatch.setenv("SESSION_DURATION", "2")
+    monkeypatch.setattr(SessionExpAuth, "user_id_by_session_id",
+                        OrderedDict())
+    monkeypatch.setattr(SessionExpAuth, "_expiry_heap", [])
+    monkeypatch.setattr(SessionExpAuth, "evictions",
+                        {'expired': 0, 'capacity': 0})
+    login_auth, request_auth = SessionExpAuth(), SessionExpAuth()
+
+    # Expires 0.2s from now; only login_auth pushed it on the heap
+    login_auth._remember_session("old", "user-1",
+                                 datetime.now() - timedelta(seconds=1.8))
+    session_id = login_auth.create_session("user-2")
+    time.sleep(0.3)
+
+    assert request_auth.user_id_for_session_id("old") is None
+    assert request_auth.user_id_for_session_id(session_id) == "user-2"
+    assert "old" not in SessionExpAuth.user_id_by_session_id
+    assert login_auth.session_stats()['expired_evictions'] == 1
+
+
+def test_store_readers_never_see_a_partial_file(tmp_path, monkeypatch):
+    """ Another worker reloading the store while it is saved reads a
+    complete file
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(models.base, "DATA", {})
+    monkeypatch.setattr(models.base, "LOADED", {"UserSession"})
+    sessions = [UserSession(user_id=str(i), session_id=str(i))
+                for i in range(2000)]
+    models.base.DATA["UserSession"] = {s.id: s for s in sessions}
+    UserSession.save_to_file()
+    done = threading.Event()
+
+    def write():
+        for _ in range(50):
+            UserSession.save_to_file()
+        done.set()
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    reads = 0
+    while not done.is_set():
+        with open(".db_UserSession.json") as f:
+            assert len(json.load(f)) == 2000
+        reads += 1
+    writer.join()
+    assert reads > 0
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+@pytest.fixture
+def signed_auth(user, monkeypatch):
+    """ SignedSessionAuth as the app's auth, with an empty revocation file
+    """
+    monkeypatch.setenv("SESSION_NAME", "_my_session_id")
+    monkeypatch.setenv("SESSION_SECRET", "s3cr3t")
+    monkeypatch.setattr(SignedSessionAuth, "revoked",
+                        RevocationList(REVOCATION_FILE))
+    auth = SignedSessionAuth()
+    monkeypatch.setattr(app_module, "auth", auth)
+    return auth
+
+
+def test_signed_session_rejects_non_ascii_token(signed_auth):
+    """ A garbage non-ASCII cookie is a 403, not a 500
+    """
+    client = app_module.app.test_client()
+    client.set_cookie("_my_session_id", "abc.d\u00e9f")
+    assert client.get("/api/v1/users/me").status_code == 403
+
+
+def test_signed_session_revocation_is_shared(user, signed_auth):
+    """ A logout through any instance, or any worker using the same
+    revocation file, revokes the token everywhere
+    """
+    session_id = signed_auth.create_session(user.id)
+    token_id = signed_auth._claims(session_id)[1]
+    other_worker = RevocationList(REVOCATION_FILE)
+    client = app_module.app.test_client()
+    client.set_cookie("_my_session_id", session_id)
+    assert client.get("/api/v1/users/me").status_code == 200
+
+    # The views use a second instance, as under python3 -m api.v1.app
+    with app_module.app.test_request_context(
+            headers={"Cookie": "_my_session_id=" + session_id}):
+        assert SignedSessionAuth().destroy_session(app_module.request)
+
+    assert client.get("/api/v1/users/me").status_code == 403
+    assert token_id in other_worker
+    assert "not-revoked" not in other_worker
+
+
+def test_revocation_prune_keeps_live_tokens(tmp_path):
+    """ Compacting the file drops expired tokens only, and other
+    processes reload the compacted file
+    """
+    path = str(tmp_path / "revoked.log")
+    revoked, other_worker = RevocationList(path), RevocationList(path)
+    now = int(time.time())
+    revoked.add("expired", now - 1)
+    revoked.add("live", now + 60)
+    assert "expired" in other_worker
+
+    revoked.prune(now)
+    with open(path) as f:
+        assert f.read().split() == ["live", str(now + 60)]
+    assert "expired" not in revoked
+    assert "expired" not in other_worker
+    assert "live" in other_worker
+
+
+def test_signed_session_tokens_always_expire(user, signed_auth,
+                                             monkeypatch):
+    """ Tokens expire after the default duration, and a duration that
+    would never expire them is refused
+    """
+    session_id = signed_auth.create_session(user.id)
+    expires = signed_auth._claims(session_id)[2]
+    assert 0 < expires - time.time() <= 86400
+    for duration in ("0", "-1"):
+        monkeypatch.setenv("SESSION_DURATION", duration)
+        with pytest.raises(ValueError):
+            SignedSessionAuth()
+
+
+def test_throttle_never_locks_new_keys_out():
+    """ Spraying more than max_keys keys evicts the least recently used
+    buckets instead of throttling every new key
+    """
+    limiter = TokenBucketLimiter(burst=5, rate=0.1, max_keys=3)
+    for i in range(100):
+        assert limiter.consume("spray{}".format(i)) == 0
+    assert limiter.consume("new user") == 0
+    assert len(limiter._buckets) == 3
+    assert limiter.evicted == 98
+    assert limiter.throttled == 0
+
+
+def test_throttle_keeps_recently_used_buckets():
+    """ A key in use keeps its depleted bucket while others come and go
+    """
+    limiter = TokenBucketLimiter(burst=2, rate=0.01, max_keys=3)
+    assert limiter.consume("victim") == 0
+    assert limiter.consume("victim") == 0
+    for i in range(10):
+        limiter.consume("spray{}".format(i))
+        assert limiter.consume("victim") > 0
+
+
+def test_throttle_drops_refilled_buckets():
+    """ Buckets are forgotten once full again
+    """
+    limiter = TokenBucketLimiter(burst=1, rate=20, max_keys=10)
+    assert limiter.consume("a") == 0
+    assert limiter.consume("b") == 0
+    assert limiter.consume("b") > 0
+    time.sleep(0.1)
+    assert limiter.consume("c") == 0
+    assert list(limiter._buckets) == ["c"]
+
+
+def test_store_writes_from_two_workers_are_kept(user):
+    """ Users saved concurrently by two forked workers all end up in the
+    store, and each worker sees the other's writes
+    """
+    pids = []
+    for worker in range(2):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                for i in range(25):
+                    User(email="w{}-{}@hbtn.io".format(worker, i)).save()
+            finally:
+                os._exit(0)
+        pids.append(pid)
+    for pid in pids:
+        os.waitpid(pid, 0)
+
+    # As at the start of the next request
+    models.base.reload_changed()
+    assert User.count() == 51
+    with open(".db_User.json") as f:
+        assert len(json.load(f)) == 51
+
+
+def test_store_is_checked_once_per_request(user, monkeypatch):
+    """ Reads in a request do not stat the store file; the request
+    checks it once, up front
+    """
+    checks = count_calls(monkeypatch, User, "_current_version")
+    client = app_module.app.test_client()
+    assert client.get("/api/v1/users/" + user.id).status_code == 200
+    assert len(checks) == 1
+    User.get(user.id)
+    User.search({"email": "bob@hbtn.io"})
+    assert len(checks) == 1
+
+
+@pytest.fixture
+def db_auth(user, monkeypatch):
+    """ SessionDBAuth as the app's auth, with empty shared caches
+    """
+    monkeypatch.setenv("SESSION_NAME", "_my_session_id")
+    monkeypatch.setenv("SESSION_DURATION", "60")
+    monkeypatch.setattr(SessionExpAuth, "user_id_by_session_id",
+                        OrderedDict())
+    monkeypatch.setattr(SessionExpAuth, "_expiry_heap", [])
+    monkeypatch.setattr(SessionDBAuth, "_unknown_session_ids",
+                        OrderedDict())
+    monkeypatch.setattr(SessionDBAuth, "_store_generation", None)
+    monkeypatch.setattr(SessionDBAuth, "_next_sweep", 0)
+    auth = SessionDBAuth()
+    monkeypatch.setattr(app_module, "auth", auth)
+    return auth
+
+
+def test_session_db_auth_reads_through_the_cache(user, db_auth,
+                                                 monkeypatch):
+    """ A session is read from the store once, then served from the
+    cache; unknown session IDs are remembered too
+    """
+    session_id = db_auth.create_session(user.id)
+    assert UserSession.get(session_id).user_id == user.id
+    SessionExpAuth.user_id_by_session_id.clear()
+    reads = count_calls(monkeypatch, UserSession, "get")
+
+    for _ in range(3):
+        assert db_auth.user_id_for_session_id(session_id) == user.id
+        assert db_auth.user_id_for_session_id("unknown") is None
+    assert len(reads) == 2
+    client = app_module.app.test_client()
+    client.set_cookie("_my_session_id", session_id)
+    assert client.get("/api/v1/users/me").status_code == 200
+    assert len(reads) == 2
+
+
+def test_session_db_auth_expires_and_sweeps_sessions(user, db_auth,
+                                                     monkeypatch):
+    """ Expired sessions are refused, and swept from the store when a
+    session is saved
+    """
+    monkeypatch.setattr(db_auth, "sweep_interval", 0)
+    expired = [db_auth.create_session(user.id) for _ in range(2)]
+    for session_id in expired:
+        UserSession.get(session_id).created_at -= timedelta(seconds=120)
+    SessionExpAuth.user_id_by_session_id.clear()
+    assert db_auth.user_id_for_session_id(expired[0]) is None
+    assert UserSession.get(expired[0]) is None
+
+    live = db_auth.create_session(user.id)
+    with open(".db_UserSession.json") as f:
+        assert list(json.load(f)) == [live]
+
+
+def test_session_db_auth_logout_reaches_other_workers(user, db_auth):
+    """ A logout in another worker evicts the session from this
+    worker's cache at its next request
+    """
+    session_id = db_auth.create_session(user.id)
+    assert db_auth.user_id_for_session_id(session_id) == user.id
+    pid = os.fork()
+    if pid == 0:
+        try:
+            with app_module.app.test_request_context(
+                    headers={"Cookie": "_my_session_id=" + session_id}):
+                assert db_auth.destroy_session(app_module.request)
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+
+    assert db_auth.user_id_for_session_id(session_id) == user.id
+    client = app_module.app.test_client()
+    client.set_cookie("_my_session_id", session_id)
+    assert client.get("/api/v1/users/me").status_code == 403
+    assert db_auth.user_id_for_session_id(session_id) is None
+
+
+async def asgi_get(application, path: str, headers: list = ()) -> tuple:
+    """ GET path from an ASGI application; return (status, headers, body)
+    """
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+
+    async def send(message):
+        messages.append(message)
+
+    await application({'type': 'http', 'method': 'GET', 'path': path,
+                       'query_string': b'', 'http_version': '1.1',
+                       'headers': list(headers),
+                       'client': ('127.0.0.1', 1234)}, receive, send)
+    start = messages[0]
+    body = b''.join(m.get('body', b'') for m in messages[1:])
+    return start['status'], dict(start['headers']), body
+
+
+def test_asgi_serves_the_app(user, monkeypatch):
+    """ Requests go through the adapter with their headers and cookies
+    """
+    monkeypatch.setenv("SESSION_NAME", "_my_session_id")
+    auth = SessionAuth()
+    monkeypatch.setattr(app_module, "auth", auth)
+    session_id = auth.create_session(user.id)
+    status, headers, body = asyncio.run(asgi_get(
+        asgi_app, "/api/v1/users/me",
+        [(b"cookie", b"other=1"),
+         (b"cookie", "_my_session_id={}".format(session_id).encode())]))
+    assert status == 200
+    assert headers[b"content-type"] == b"application/json"
+    assert json.loads(body)["email"] == "bob@hbtn.io"
+
+
+def test_asgi_runs_requests_concurrently():
+    """ Slow requests run side by side on the thread pool
+    """
+    def slow(environ, start_response):
+        time.sleep(0.3)
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b"ok"]
+
+    async def run():
+        application = WsgiToAsgi(slow, ThreadPoolExecutor(max_workers=4))
+        return await asyncio.gather(*(asgi_get(application, "/")
+                                      for _ in range(4)))
+
+    started = time.perf_counter()
+    results = asyncio.run(run())
+    assert time.perf_counter() - started < 0.9
+    assert [body for _, _, body in results] == [b"ok"] * 4
+
+
+def test_user_etag_and_conditional_get(user):
+    """ GET returns the User ETag and 304 when it still matches
+    """
+    client = app_module.app.test_client()
+    response = client.get("/api/v1/users/" + user.id)
+    etag = response.headers["ETag"]
+    assert response.status_code == 200 and etag
+    response = client.get("/api/v1/users/" + user.id,
+                          headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.data == b""
+
+
+def test_user_put_with_stale_etag_fails(user):
+    """ PUT with the ETag of an older version is refused, even when the
+    two saves happen within the same second
+    """
+    client = app_module.app.test_client()
+    path = "/api/v1/users/" + user.id
+    etag = client.get(path).headers["ETag"]
+    response = client.put(path, json={"first_name": "Bob"},
+                          headers={"If-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    response = client.put(path, json={"first_name": "Rob"},
+                          headers={"If-Match": etag})
+    assert response.status_code == 412
+    assert User.get(user.id).first_name == "Bob"
+
+
+def test_user_etag_survives_reload(user):
+    """ Reloading the store, as after another worker's write, keeps the
+    ETag of unchanged users
+    """
+    client = app_module.app.test_client()
+    path = "/api/v1/users/" + user.id
+    etag = client.get(path).headers["ETag"]
+    User.load_from_file()
+    assert client.get(path).headers["ETag"] == etag
+    response = client.put(path, json={"last_name": "Dylan"},
+                          headers={"If-Match": etag})
+    assert response.status_code == 200
+
+
+def test_compressed_list_has_strong_etag_per_encoding(user):
+    """ The gzip representation has its own strong ETag, which
+    If-None-Match recognises
+    """
+    for i in range(20):
+        models.base.DATA["User"][str(i)] = User(email="{}@hbtn.io".format(i))
+    client = app_module.app.test_client()
+    identity = client.get("/api/v1/users",
+                          headers={"Accept-Encoding": "identity"})
+    gzipped = client.get("/api/v1/users",
+                         headers={"Accept-Encoding": "gzip"})
+    assert gzipped.headers["Content-Encoding"] == "gzip"
+    etag, weak = gzipped.get_etag()
+    assert not weak and etag == identity.get_etag()[0] + "-gzip"
+    assert "Accept-Encoding" in identity.headers["Vary"]
+
+    response = client.get("/api/v1/users", headers={
+        "Accept-Encoding": "gzip", "If-None-Match": '"{}"'.format(etag)})
+    assert response.status_code == 304
+    assert response.get_etag() == (etag, False)
+
+
+def test_user_if_match_is_strong(user):
+    """ If-Match accepts the ETag of any content coding of the current
+    version, but not a weak ETag
+    """
+    client = app_module.app.test_client()
+    path = "/api/v1/users/" + user.id
+    etag = client.get(path).get_etag()[0]
+    response = client.put(path, json={"first_name": "Bob"},
+                          headers={"If-Match": 'W/"{}"'.format(etag)})
+    assert response.status_code == 412
+    response = client.put(path, json={"first_name": "Bob"},
+                          headers={"If-Match": '"{}-gzip"'.format(etag)})
+    assert response.status_code == 200
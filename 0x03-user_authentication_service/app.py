@@ -3,11 +3,49 @@
 App module which serves as entry point to the application.
 """
 from auth import Auth
+from password_pool import PasswordPoolOverloaded
+from throttle import login_retry_after
+import sql_stats
 from flask import Flask, jsonify, request, abort, make_response, redirect
+import os
 
 
 app = Flask(__name__)
 AUTH = Auth()
+SESSION_SWEEP_INTERVAL = int(os.getenv("SESSION_SWEEP_INTERVAL", "300"))
+if SESSION_SWEEP_INTERVAL > 0:
+    AUTH.start_session_sweeper(SESSION_SWEEP_INTERVAL)
+
+
+@app.before_request
+def count_queries():
+    """Start counting the SQL statements of the request."""
+    sql_stats.begin_request()
+
+
+@app.after_request
+def query_headers(response):
+    """In debug mode, report the SQL statements run by the request."""
+    stats = sql_stats.end_request()
+    if app.debug and stats is not None:
+        response.headers["X-DB-Queries"] = str(stats.count)
+        response.headers["X-DB-Time-Ms"] = "{:.3f}".format(
+            stats.seconds * 1000)
+    return response
+
+
+@app.teardown_appcontext
+def end_request(exception=None):
+    """Release the database session of the request."""
+    AUTH.end_request()
+
+
+@app.errorhandler(PasswordPoolOverloaded)
+def overloaded(error):
+    """Fail fast when the password hashing pool is saturated."""
+    response = make_response(jsonify({"message": "server busy"}), 503)
+    response.headers["Retry-After"] = "1"
+    return response
 
 
 @app.route("/", methods=["GET"])
@@ -16,6 +54,14 @@ def index():
     return jsonify({"message": "Bienvenue"})
 
 
+@app.route("/stats", methods=["GET"])
+def stats():
+    """Endpoint reporting database, password pool and cache statistics."""
+    return jsonify({"db": AUTH.db_stats(),
+                    "passwords": AUTH.passwords.stats(),
+                    "session_cache": AUTH.session_cache.stats()})
+
+
 @app.route("/users", methods=["POST"])
 def users():
     """Endpoint to register a user."""
@@ -35,6 +81,13 @@ def login():
     email = request.form.get("email")
     password = request.form.get("password")
 
+    retry_after = login_retry_after(request.remote_addr, email)
+    if retry_after:
+        response = make_response(jsonify({"message": "too many requests"}),
+                                 429)
+        response.headers["Retry-After"] = str(retry_after)
+        return response
+
     if AUTH.valid_login(email, password):
         session_id = AUTH.create_session(email)
         response = make_response(jsonify({"email": email,
@@ -52,7 +105,7 @@ def logout():
 
     user = AUTH.get_user_from_session_id(session_id)
     if user:
-        AUTH.destroy_session(user.id)
+        AUTH.destroy_session(user.id, session_id)
         return redirect("/")
     else:
         abort(403, "Invalid session ID.")
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Async app module: the routes of app.py on Quart and AsyncAuth, so that
+slow clients do not each hold a worker thread.
+Run with `hypercorn async_app:app`.
+"""
+from async_auth import AsyncAuth
+from password_pool import PasswordPoolOverloaded
+from throttle import login_retry_after
+from quart import Quart, jsonify, request, abort, make_response, redirect
+import asyncio
+import os
+
+
+app = Quart(__name__)
+AUTH = AsyncAuth()
+SESSION_SWEEP_INTERVAL = int(os.getenv("SESSION_SWEEP_INTERVAL", "300"))
+
+
+@app.before_serving
+async def startup():
+    """Set up the database and start the session sweeper."""
+    await AUTH.setup()
+    if SESSION_SWEEP_INTERVAL > 0:
+        app.sweeper = asyncio.ensure_future(
+            AUTH.sweep_sessions(SESSION_SWEEP_INTERVAL))
+
+
+@app.after_serving
+async def shutdown():
+    """Stop the session sweeper."""
+    sweeper = getattr(app, "sweeper", None)
+    if sweeper is not None:
+        sweeper.cancel()
+
+
+@app.errorhandler(PasswordPoolOverloaded)
+async def overloaded(error):
+    """Fail fast when the password hashing pool is saturated."""
+    response = await make_response(jsonify({"message": "server busy"}), 503)
+    response.headers["Retry-After"] = "1"
+    return response
+
+
+@app.route("/", methods=["GET"])
+async def index():
+    """Route handler for the root endpoint."""
+    return jsonify({"message": "Bienvenue"})
+
+
+@app.route("/users", methods=["POST"])
+async def users():
+    """Endpoint to register a user."""
+    form = await request.form
+    email = form.get("email")
+    password = form.get("password")
+    try:
+        await AUTH.register_user(email, password)
+        return jsonify({"email": email, "message": "user created"}), 200
+    except ValueError:
+        return jsonify({"message": "email already registered"}), 400
+
+
+@app.route("/sessions", methods=["POST"])
+async def login():
+    """Endpoint to log in a user."""
+    form = await request.form
+    email = form.get("email")
+    password = form.get("password")
+
+    retry_after = login_retry_after(request.remote_addr, email)
+    if retry_after:
+        response = await make_response(
+            jsonify({"message": "too many requests"}), 429)
+        response.headers["Retry-After"] = str(retry_after)
+        return response
+
+    if await AUTH.valid_login(email, password):
+        session_id = await AUTH.create_session(email)
+        response = await make_response(jsonify({"email": email,
+                                                "message": "logged in"}),
+                                       200)
+        response.set_cookie("session_id", session_id)
+        return response
+    else:
+        abort(401, "Invalid email or password.")
+
+
+@app.route("/sessions", methods=["DELETE"])
+async def logout():
+    """Endpoint to log out a user."""
+    session_id = request.cookies.get("session_id")
+
+    user = await AUTH.get_user_from_session_id(session_id)
+    if user:
+        await AUTH.destroy_session(user.id, session_id)
+        return redirect("/")
+    else:
+        abort(403, "Invalid session ID.")
+
+
+@app.route("/profile", methods=["GET"])
+async def profile():
+    """
+    Endpoint to retrieve user profile.
+    """
+    session_id = request.cookies.get("session_id")
+
+    user = await AUTH.get_user_from_session_id(session_id)
+    if user:
+        return jsonify({"email": user.email}), 200
+    else:
+        abort(403, "Invalid session ID.")
+
+
+@app.route("/reset_password", methods=["POST"])
+async def get_reset_password_token():
+    """Endpoint to generate a reset password token."""
+    form = await request.form
+    email = form.get("email")
+
+    if not email:
+        abort(400, "Email not provided.")
+
+    try:
+        reset_token = await AUTH.get_reset_password_token(email)
+        return jsonify({"email": email,
+                        "reset_token": reset_token}), 200
+    except ValueError as e:
+        abort(403, str(e))
+
+
+@app.route("/reset_password", methods=["PUT"])
+async def update_password():
+    """
+    Endpoint to update the password.
+    """
+    form = await request.form
+    email = form.get("email")
+    reset_token = form.get("reset_token")
+    new_password = form.get("new_password")
+
+    if not email or not reset_token or not new_password:
+        abort(400, "Missing required fields.")
+
+    try:
+        await AUTH.update_password(reset_token, new_password)
+        return jsonify({"email": email,
+                        "message": "Password updated"}), 200
+    except ValueError as e:
+        abort(403, str(e))
+
+
+if __name__ == "__main__":
+    app.run(host="0.0.0.0", port=5000)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Async Auth module
+"""
+
+import asyncio
+import uuid
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import NoResultFound
+from async_db import AsyncDB
+from auth import _digest, _generate_uuid, configure
+from session_cache import MISSING, UserSnapshot
+from user import User
+
+
+class AsyncAuth:
+    """AsyncAuth class: asyncio counterpart of Auth on AsyncDB.
+    """
+
+    def __init__(self):
+        """ Initialise an AsyncDB instance; call setup() before use
+        """
+        self._db = AsyncDB()
+        configure(self)
+
+    async def setup(self) -> None:
+        """
+        Set up the database schema
+        """
+        await self._db.setup()
+
+    async def register_user(self, email: str, password: str) -> User:
+        """
+        Registers a new user.
+        """
+        hashed_password = await self.passwords.hash_async(password)
+        try:
+            return await self._db.add_user(email=email,
+                                           hashed_password=hashed_password)
+        except IntegrityError:
+            raise ValueError(f"User {email} already exists")
+
+    async def valid_login(self, email: str, password: str) -> bool:
+        """
+        Check if the login credentials are valid.
+        """
+        try:
+            user = await self._db.find_user_by(email=email)
+        except NoResultFound:
+            return False
+        return await self.passwords.check_async(password,
+                                                user.hashed_password)
+
+    async def create_session(self, email: str) -> str:
+        """
+        Create a session for the user and return the session ID.
+        """
+        try:
+            user = await self._db.find_user_by(email=email)
+        except NoResultFound:
+            return None
+        session_id = _generate_uuid()
+        await self._db.add_session(user.id, session_id,
+                                   self.session_duration)
+        self.session_cache.invalidate(session_id)
+        return session_id
+
+    async def get_user_from_session_id(self,
+                                       session_id: str) -> UserSnapshot:
+        """
+        Get a snapshot (id, email) of the user corresponding to the given
+        session ID. Known and unknown session IDs are both cached.
+        """
+        if not session_id:
+            return None
+        snapshot = self.session_cache.get(session_id)
+        if snapshot is not MISSING:
+            return snapshot
+        generation = self.session_cache.generation()
+        try:
+            user, expires_at = await self._db.find_session(
+                session_id, self.session_touch_interval)
+            snapshot = UserSnapshot(user.id, user.email)
+            ttl = (expires_at - datetime.utcnow()).total_seconds()
+        except NoResultFound:
+            snapshot, ttl = None, None
+        self.session_cache.put(session_id, snapshot, ttl, generation)
+        return snapshot
+
+    async def destroy_session(self, user_id: int,
+                              session_id: str = None) -> None:
+        """
+        Destroy one session of the user with the given user ID, or all of
+        the user's sessions when no session ID is given.
+        """
+        await self._db.delete_sessions(user_id, session_id)
+        if session_id is None:
+            self.session_cache.invalidate_user(user_id)
+        else:
+            self.session_cache.invalidate(session_id)
+
+    async def sweep_sessions(self, interval: float,
+                             batch_size: int = 500) -> None:
+        """
+        Delete expired sessions and reset tokens every `interval` seconds,
+        batch_size rows per transaction. Runs until cancelled.
+        """
+        while True:
+            try:
+                await self._db.purge_expired(batch_size)
+            except Exception:
+                pass  # retried at the next interval
+            await asyncio.sleep(interval)
+
+    async def get_reset_password_token(self, email: str) -> str:
+        """
+        Generate a reset password token for the user with the given email.
+        Only its SHA-256 digest is stored.
+        """
+        try:
+            user = await self._db.find_user_by(email=email)
+        except NoResultFound:
+            raise ValueError(f"User with email '{email}' does not exist.")
+        reset_token = str(uuid.uuid4())
+        await self._db.add_reset_token(user.id, _digest(reset_token),
+                                       self.reset_token_duration)
+        return reset_token
+
+    async def update_password(self, reset_token: str,
+                              new_password: str) -> None:
+        """
+        Update user's password using reset token, see
+        Auth.update_password
+        """
+        token_hash = _digest(reset_token)
+        try:
+            await self._db.find_reset_token(token_hash)
+            hashed_password = await self.passwords.hash_async(new_password)
+            user_id = await self._db.reset_password(token_hash,
+                                                    hashed_password)
+        except NoResultFound:
+            raise ValueError("Reset token does not exist.")
+        self.session_cache.invalidate_user(user_id)
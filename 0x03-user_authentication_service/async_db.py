@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Async DB module
+"""
+from os import getenv
+from datetime import datetime, timedelta
+from sqlalchemy import delete, event, update
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy.exc import IntegrityError, InvalidRequestError
+from db import (_set_sqlite_pragmas, check_user_attributes,
+                consume_reset_token_statement, delete_expired_batch,
+                find_reset_token_statement, find_session_statement,
+                find_user_statement,
+                prepare_schema, reset_password_statements)
+from user import ResetToken, User, UserSession
+from sql_stats import instrument
+
+
+class AsyncDB:
+    """AsyncDB class: asyncio counterpart of DB on aiosqlite
+    """
+
+    def __init__(self) -> None:
+        """Initialize a new AsyncDB instance; call setup() before use
+        """
+        self._engine = create_async_engine(
+            "sqlite+aiosqlite:///{}".format(getenv("DB_PATH", "a.db")),
+            echo=False)
+        event.listen(self._engine.sync_engine, "connect",
+                     _set_sqlite_pragmas)
+        instrument(self._engine.sync_engine)
+        self._sessions = sessionmaker(self._engine, class_=AsyncSession,
+                                      expire_on_commit=False)
+
+    async def setup(self) -> None:
+        """
+        Set up the schema, see db.prepare_schema
+        """
+        async with self._engine.begin() as connection:
+            await connection.run_sync(prepare_schema)
+
+    async def add_user(self, email: str, hashed_password: str) -> User:
+        """
+        Add a new user to the database
+        """
+        user = User(email=email, hashed_password=hashed_password)
+        async with self._sessions() as session:
+            session.add(user)
+            try:
+                await session.commit()
+            except IntegrityError as e:
+                await session.rollback()
+                raise e
+        return user
+
+    async def find_user_by(self, **kwargs) -> User:
+        """
+        Find a user in the database by arbitrary keyword arguments
+        """
+        try:
+            statement, params = find_user_statement(kwargs)
+        except InvalidRequestError as e:
+            raise e
+        async with self._sessions() as session:
+            user = (await session.execute(statement, params)) \
+                .scalars().first()
+        if user is None:
+            raise NoResultFound
+        return user
+
+    async def update_user(self, user_id: int, **kwargs) -> None:
+        """
+        Update a user in the database with a single UPDATE statement
+        """
+        check_user_attributes(kwargs)
+        if not kwargs:
+            await self.find_user_by(id=user_id)
+            return
+
+        users = User.__table__
+        async with self._sessions() as session:
+            result = await session.execute(
+                update(users).where(users.c.id == user_id).values(**kwargs))
+            if result.rowcount == 0:
+                await session.rollback()
+                raise NoResultFound
+            await session.commit()
+
+    async def add_session(self, user_id: int, session_id: str,
+                          duration: timedelta) -> UserSession:
+        """
+        Add a session of a user lasting `duration`
+        """
+        now = datetime.utcnow()
+        user_session = UserSession(session_id=session_id, user_id=user_id,
+                                   created_at=now, expires_at=now + duration,
+                                   last_seen=now)
+        async with self._sessions() as session:
+            session.add(user_session)
+            await session.commit()
+        return user_session
+
+    async def find_session(self, session_id: str,
+                           touch_interval: timedelta):
+        """
+        Find the user and expiry of a live session, see DB.find_session
+        """
+        now = datetime.utcnow()
+        sessions = UserSession.__table__
+        async with self._sessions() as session:
+            row = (await session.execute(
+                find_session_statement(session_id, now))).first()
+            if row is None:
+                raise NoResultFound
+            user, expires_at, last_seen = row
+            if now - last_seen >= touch_interval:
+                await session.execute(
+                    update(sessions)
+                    .where(sessions.c.session_id == session_id)
+                    .values(last_seen=now))
+                await session.commit()
+        return user, expires_at
+
+    async def delete_sessions(self, user_id: int,
+                              session_id: str = None) -> None:
+        """
+        Delete one session of a user, or all of them
+        """
+        sessions = UserSession.__table__
+        statement = delete(sessions).where(sessions.c.user_id == user_id)
+        if session_id is not None:
+            statement = statement.where(sessions.c.session_id == session_id)
+        async with self._sessions() as session:
+            await session.execute(statement)
+            await session.commit()
+
+    async def add_reset_token(self, user_id: int, token_hash: str,
+                              duration: timedelta) -> None:
+        """
+        Add the digest of a reset token of a user lasting `duration`
+        """
+        async with self._sessions() as session:
+            session.add(ResetToken(
+                token_hash=token_hash, user_id=user_id,
+                expires_at=datetime.utcnow() + duration))
+            await session.commit()
+
+    async def find_reset_token(self, token_hash: str) -> int:
+        """
+        Return the user ID of a live reset token, see
+        DB.find_reset_token
+        """
+        async with self._sessions() as session:
+            user_id = (await session.execute(
+                find_reset_token_statement(token_hash))).scalar()
+        if user_id is None:
+            raise NoResultFound
+        return user_id
+
+    async def reset_password(self, token_hash: str,
+                             hashed_password: str) -> int:
+        """
+        Consume a reset token and set its user's password in one
+        transaction, see DB.reset_password
+        """
+        async with self._sessions() as session:
+            user_id = (await session.execute(
+                consume_reset_token_statement(token_hash))).scalar()
+            if user_id is None:
+                await session.rollback()
+                raise NoResultFound
+            for statement in reset_password_statements(user_id,
+                                                       hashed_password):
+                await session.execute(statement)
+            await session.commit()
+        return user_id
+
+    async def purge_expired(self, batch_size: int = 500) -> int:
+        """
+        Delete expired sessions and reset tokens batch_size rows per
+        transaction. Return the rows deleted.
+        """
+        deleted = 0
+        for table, key in ((UserSession.__table__,
+                            UserSession.__table__.c.session_id),
+                           (ResetToken.__table__,
+                            ResetToken.__table__.c.token_hash)):
+            while True:
+                async with self._sessions() as session:
+                    result = await session.execute(
+                        delete_expired_batch(table, key, batch_size))
+                    await session.commit()
+                deleted += result.rowcount
+                if result.rowcount < batch_size:
+                    break
+        return deleted
@@ -4,9 +4,17 @@ Auth module with password hashing
 """
 
 import bcrypt
+import hashlib
+import os
+import threading
+import time
 import uuid
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound
 from db import DB
+from password_pool import PasswordPool
+from session_cache import MISSING, SessionCache, UserSnapshot
 from user import User
 
 
@@ -26,6 +34,30 @@ def _hash_password(password: str) -> bytes:
     return hashed_password
 
 
+def _digest(token: str) -> str:
+    """
+    SHA-256 hex digest of a token, as stored in the database
+    """
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def configure(auth) -> None:
+    """
+    Set up the password pool, session cache and durations of an Auth
+    or AsyncAuth from the environment
+    """
+    auth.passwords = PasswordPool()
+    auth.session_cache = SessionCache(
+        int(os.getenv("SESSION_CACHE_SIZE", "10000")),
+        float(os.getenv("SESSION_CACHE_TTL", "30")))
+    auth.session_duration = timedelta(
+        seconds=int(os.getenv("SESSION_DURATION", "86400")))
+    auth.session_touch_interval = timedelta(
+        seconds=int(os.getenv("SESSION_TOUCH_INTERVAL", "60")))
+    auth.reset_token_duration = timedelta(
+        seconds=int(os.getenv("RESET_TOKEN_DURATION", "3600")))
+
+
 class Auth:
     """Auth class to interact with the authentication database.
     """
@@ -34,19 +66,30 @@ class Auth:
         """ Initialise a db instance
         """
         self._db = DB()
+        configure(self)
+
+    def end_request(self) -> None:
+        """
+        Release the database session used by the current request
+        """
+        self._db.remove_session()
+
+    def db_stats(self) -> dict:
+        """
+        Database pool and query statistics
+        """
+        return self._db.stats()
 
     def register_user(self, email: str, password: str) -> User:
         """
         Registers a new user.
         """
+        hashed_password = self.passwords.hash(password)
         try:
-            existing_user = self._db.find_user_by(email=email)
+            user = self._db.add_user(email=email,
+                                     hashed_password=hashed_password)
+        except IntegrityError:
             raise ValueError(f"User {email} already exists")
-        except NoResultFound:
-            pass
-
-        hashed_password = _hash_password(password)
-        user = self._db.add_user(email=email, hashed_password=hashed_password)
 
         return user
 
@@ -57,7 +100,7 @@ class Auth:
         try:
             user = self._db.find_user_by(email=email)
             hashed_password = user.hashed_password
-            return bcrypt.checkpw(password.encode('utf-8'), hashed_password)
+            return self.passwords.check(password, hashed_password)
         except NoResultFound:
             return False
 
@@ -68,54 +111,90 @@ class Auth:
         try:
             user = self._db.find_user_by(email=email)
             session_id = _generate_uuid()
-            self._db.update_user(user.id, session_id=session_id)
+            self._db.add_session(user.id, session_id, self.session_duration)
+            self.session_cache.invalidate(session_id)
             return session_id
-        except ValueError:
+        except (ValueError, NoResultFound):
             return None
 
-    def get_user_from_session_id(self, session_id: str) -> None:
+    def get_user_from_session_id(self, session_id: str) -> UserSnapshot:
         """
-        Get the user corresponding to the given session ID.
+        Get a snapshot (id, email) of the user corresponding to the given
+        session ID. Known and unknown session IDs are both cached.
         """
         if session_id:
+            snapshot = self.session_cache.get(session_id)
+            if snapshot is not MISSING:
+                return snapshot
+            generation = self.session_cache.generation()
             try:
-                user = self._db.find_user_by(session_id=session_id)
-                return user
+                user, expires_at = self._db.find_session(
+                    session_id, self.session_touch_interval)
+                snapshot = UserSnapshot(user.id, user.email)
+                ttl = (expires_at - datetime.utcnow()).total_seconds()
             except NoResultFound:
-                return None
+                snapshot, ttl = None, None
+            self.session_cache.put(session_id, snapshot, ttl, generation)
+            return snapshot
         else:
             return None
 
-    def destroy_session(self, user_id: int) -> None:
+    def destroy_session(self, user_id: int, session_id: str = None) -> None:
         """
-        Destroy the session for the user with the given user ID.
+        Destroy one session of the user with the given user ID, or all of
+        the user's sessions when no session ID is given.
         """
-        try:
-            self._db.update_user(user_id, session_id=None)
-        except ValueError:
-            pass
+        self._db.delete_sessions(user_id, session_id)
+        if session_id is None:
+            self.session_cache.invalidate_user(user_id)
+        else:
+            self.session_cache.invalidate(session_id)
         return None
 
+    def start_session_sweeper(self, interval: float,
+                              batch_size: int = 500) -> None:
+        """
+        Delete expired sessions and reset tokens every `interval` seconds
+        in a background thread, batch_size rows per transaction.
+        """
+        def sweep():
+            while True:
+                try:
+                    self._db.purge_expired_sessions(batch_size)
+                    self._db.purge_expired_reset_tokens(batch_size)
+                except Exception:
+                    pass  # retried at the next interval
+                finally:
+                    self._db.remove_session()
+                time.sleep(interval)
+
+        threading.Thread(target=sweep, daemon=True).start()
+
     def get_reset_password_token(self, email: str) -> str:
         """
         Generate a reset password token for the user with the given email.
+        Only its SHA-256 digest is stored.
         """
         try:
             user = self._db.find_user_by(email=email)
             reset_token = str(uuid.uuid4())
-            self._db.update_user(user.id, reset_token=reset_token)
+            self._db.add_reset_token(user.id, _digest(reset_token),
+                                     self.reset_token_duration)
             return reset_token
         except NoResultFound:
             raise ValueError(f"User with email '{email}' does not exist.")
 
     def update_password(self, reset_token: str, new_password: str) -> None:
         """
-        Update user's password using reset token.
+        Update user's password using reset token. A token works once, and
+        a reset deletes the user's other reset tokens. The token is
+        checked before the new password is hashed.
         """
+        token_hash = _digest(reset_token)
         try:
-            user = self._db.find_user_by(reset_token=reset_token)
-            hashed_password = _hash_password(new_password)
-            self._db.update_user(user.id, hashed_password=hashed_password,
-                                 reset_token=None)
+            self._db.find_reset_token(token_hash)
+            hashed_password = self.passwords.hash(new_password)
+            user_id = self._db.reset_password(token_hash, hashed_password)
         except NoResultFound:
             raise ValueError("Reset token does not exist.")
+        self.session_cache.invalidate_user(user_id)
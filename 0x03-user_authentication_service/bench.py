@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+"""
+Benchmarks of the user authentication service
+
+    $ ./bench.py index [--rows 1000000]
+    $ ./bench.py restart [--sizes 0,10000,100000,1000000]
+    $ ./bench.py update [--rows 100000] [--updates 5000]
+    $ ./bench.py register [--users 100000] [--bcrypt-rounds 12]
+    $ ./bench.py profile [--sessions 1000] [--threads 8]
+    $ ./bench.py concurrency [--clients 256] [--requests 5120]
+    $ ./bench.py threads [--threads 1,2,4,8] [--requests 4000]
+    $ ./bench.py find [--rows 10000] [--lookups 20000]
+
+Every benchmark works on its own database file (BENCH_DB_PATH, default
+bench.db), recreated at each run.
+"""
+import argparse
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+
+BENCH_DB_PATH = os.getenv("BENCH_DB_PATH", "bench.db")
+
+
+def fresh_db(persist: bool = False):
+    """Return a DB on an empty BENCH_DB_PATH database."""
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(BENCH_DB_PATH + suffix):
+            os.remove(BENCH_DB_PATH + suffix)
+    return open_db(persist)
+
+
+def open_db(persist: bool = True):
+    """Return a DB on BENCH_DB_PATH, keeping its data if persist."""
+    os.environ["DB_PATH"] = BENCH_DB_PATH
+    os.environ["DB_PERSIST"] = "1" if persist else ""
+    from db import DB
+    return DB()
+
+
+def seed_users(db, rows: int, chunk_size: int = 10000) -> list:
+    """Insert `rows` users with a dummy hash; return their emails."""
+    from sqlalchemy import insert
+    from user import User
+    emails = ["user{}@bench.io".format(i) for i in range(rows)]
+    for start in range(0, rows, chunk_size):
+        db._session.execute(insert(User.__table__), [
+            {"email": email, "hashed_password": "x"}
+            for email in emails[start:start + chunk_size]])
+        db._session.commit()
+    return emails
+
+
+def timed(func, calls: int) -> float:
+    """Call func `calls` times; return the calls per second."""
+    started = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return calls / (time.perf_counter() - started)
+
+
+def bench_index(args) -> None:
+    """find_user_by(email=...) with the email index, then without it."""
+    from sqlalchemy import text
+    db = fresh_db()
+    started = time.perf_counter()
+    emails = seed_users(db, args.rows)
+    print("seeded {} users in {:.1f}s".format(
+        args.rows, time.perf_counter() - started))
+
+    def lookup():
+        db.find_user_by(email=random.choice(emails))
+
+    indexed = timed(lookup, args.lookups)
+    db._session.execute(text("DROP INDEX ix_users_email"))
+    db._session.commit()
+    scanned = timed(lookup, args.scan_lookups)
+    print("{:<10} {:>12} {:>14}".format("plan", "lookups/s", "us/lookup"))
+    for plan, rate in (("index", indexed), ("scan", scanned)):
+        print("{:<10} {:>12.1f} {:>14.1f}".format(plan, rate, 1e6 / rate))
+    print("index speedup: {:.0f}x".format(indexed / scanned))
+
+
+def bench_restart(args) -> None:
+    """Time DB() on a persistent database as the users table grows."""
+    print("{:>9} {:>12} {:>16}".format("users", "restart ms",
+                                       "first lookup ms"))
+    for size in (int(s) for s in args.sizes.split(",")):
+        db = fresh_db()
+        seed_users(db, size + 1)
+        db.remove_session()
+        db._engine.dispose()
+
+        started = time.perf_counter()
+        db = open_db(persist=True)
+        restarted = time.perf_counter()
+        db.find_user_by(email="user{}@bench.io".format(size))
+        looked_up = time.perf_counter()
+        print("{:>9} {:>12.1f} {:>16.1f}".format(
+            size, (restarted - started) * 1000,
+            (looked_up - restarted) * 1000))
+        db.remove_session()
+        db._engine.dispose()
+
+
+def bench_update(args) -> None:
+    """Session-ID writes/s: SELECT then UPDATE (before), one UPDATE, and
+    update_users batches."""
+    db = fresh_db()
+    seed_users(db, args.rows)
+    ids = [random.randint(1, args.rows) for _ in range(args.updates)]
+    counter = iter(range(10 ** 9))
+
+    def select_then_update():
+        # update_user before it issued a single UPDATE
+        user = db.find_user_by(id=random.choice(ids))
+        user.session_id = "s{}".format(next(counter))
+        db._session.commit()
+
+    def single_update():
+        db.update_user(random.choice(ids),
+                       session_id="s{}".format(next(counter)))
+
+    def batch():
+        db.update_users([{"id": user_id,
+                          "session_id": "s{}".format(next(counter))}
+                         for user_id in ids[:args.batch_size]])
+
+    print("{:<22} {:>12}".format("path", "updates/s"))
+    for name, func, per_call in (
+            ("select then update", select_then_update, 1),
+            ("update_user", single_update, 1),
+            ("update_users batch", batch, args.batch_size)):
+        calls = max(1, args.updates // per_call)
+        print("{:<22} {:>12.1f}".format(name, timed(func, calls) * per_call))
+
+
+def bench_register(args) -> None:
+    """Users/s registered by DB.add_users, and one by one."""
+    import bcrypt
+    gensalt = bcrypt.gensalt
+    bcrypt.gensalt = lambda rounds=args.bcrypt_rounds, prefix=b"2b": \
+        gensalt(rounds, prefix)
+    rows = [{"email": "user{}@bench.io".format(i),
+             "password": "pw{}".format(i)} for i in range(args.users)]
+
+    db = fresh_db()
+    started = time.perf_counter()
+    added = db.add_users(rows, workers=args.workers)
+    bulk = added / (time.perf_counter() - started)
+
+    db = fresh_db()
+    single_rows = rows[:max(1, args.users // 10)]
+    started = time.perf_counter()
+    for row in single_rows:
+        db.add_user(row["email"], db._hash_password(row["password"]))
+    single = len(single_rows) / (time.perf_counter() - started)
+
+    print("bcrypt cost {}, {} CPUs".format(args.bcrypt_rounds,
+                                           os.cpu_count()))
+    print("{:<28} {:>10}".format("path", "users/s"))
+    print("{:<28} {:>10.1f}".format(
+        "add_users ({} users)".format(added), bulk))
+    print("{:<28} {:>10.1f}".format(
+        "add_user ({} users)".format(len(single_rows)), single))
+
+
+def bench_profile(args) -> None:
+    """GET /profile requests/s with the session cache, then without it."""
+    from concurrent.futures import ThreadPoolExecutor
+    os.environ["SESSION_SWEEP_INTERVAL"] = "0"
+    fresh_db()
+    from app import app, AUTH
+    from session_cache import SessionCache
+    emails = seed_users(AUTH._db, args.sessions)
+    session_ids = [AUTH.create_session(email) for email in emails]
+    AUTH._db.remove_session()
+    per_thread = max(1, args.requests // args.threads)
+
+    def client(seed):
+        rng = random.Random(seed)
+        with app.test_client() as test_client:
+            for _ in range(per_thread):
+                test_client.set_cookie("session_id", rng.choice(session_ids))
+                response = test_client.get("/profile")
+                if response.status_code != 200:
+                    raise RuntimeError(response.status)
+
+    print("{:<10} {:>12} {:>10}".format("cache", "requests/s", "hit rate"))
+    for name, cache in (("on", SessionCache(args.sessions, 30)),
+                        ("off", SessionCache(0))):
+        AUTH.session_cache = cache
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            list(pool.map(client, range(args.threads)))
+        rate = per_thread * args.threads / (time.perf_counter() - started)
+        lookups = cache.hits + cache.misses
+        print("{:<10} {:>12.1f} {:>9.1f}%".format(
+            name, rate, 100 * cache.hits / max(1, lookups)))
+
+
+def wait_ready(port: int, timeout: float = 15) -> None:
+    """Wait until the server on `port` answers."""
+    import http.client
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/")
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def percentile(samples: list, p: float) -> float:
+    """Nearest-rank percentile of sorted samples."""
+    return samples[max(0, math.ceil(p / 100 * len(samples)) - 1)]
+
+
+def load_profile(port: int, session_ids: list, clients: int,
+                 requests: int) -> dict:
+    """GET /profile from `clients` concurrent keep-alive connections;
+    return requests/s and latency percentiles."""
+    import http.client
+    from concurrent.futures import ThreadPoolExecutor
+    per_client = max(1, requests // clients)
+
+    def client(seed):
+        rng = random.Random(seed)
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        latencies = []
+        for _ in range(per_client):
+            started = time.perf_counter()
+            conn.request("GET", "/profile", headers={
+                "Cookie": "session_id=" + rng.choice(session_ids)})
+            response = conn.getresponse()
+            response.read()
+            latencies.append(time.perf_counter() - started)
+            if response.status != 200:
+                raise RuntimeError("/profile {}".format(response.status))
+        conn.close()
+        return latencies
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        latencies = sorted(sum(pool.map(client, range(clients)), []))
+    elapsed = time.perf_counter() - started
+    return {"rps": len(latencies) / elapsed,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000}
+
+
+def seed_sessions(sessions: int) -> list:
+    """Recreate the database with `sessions` users holding one live
+    session each; return the session IDs."""
+    from datetime import datetime, timedelta
+    from sqlalchemy import insert
+    from user import UserSession
+    db = fresh_db()
+    seed_users(db, sessions)
+    session_ids = ["s{}".format(i) for i in range(sessions)]
+    now = datetime.utcnow()
+    db._session.execute(insert(UserSession.__table__), [
+        {"session_id": session_id, "user_id": user_id, "created_at": now,
+         "expires_at": now + timedelta(days=1), "last_seen": now}
+        for user_id, session_id in enumerate(session_ids, 1)])
+    db._session.commit()
+    db.remove_session()
+    db._engine.dispose()
+    return session_ids
+
+
+def bench_concurrency(args) -> None:
+    """GET /profile under many clients: app.py on the threaded Flask
+    server against async_app.py on hypercorn."""
+    session_ids = seed_sessions(args.sessions)
+    env = dict(os.environ, DB_PATH=BENCH_DB_PATH, DB_PERSIST="1",
+               SESSION_SWEEP_INTERVAL="0",
+               SESSION_CACHE_SIZE=str(args.cache_size))
+    bind = "127.0.0.1:{}".format(args.port)
+    servers = (
+        ("flask", [sys.executable, "-c",
+                   "from app import app; app.run(host='127.0.0.1', "
+                   "port={}, threaded=True)".format(args.port)]),
+        ("async", [sys.executable, "-m", "hypercorn", "--bind", bind,
+                   "--backlog", "1024", "async_app:app"]))
+    print("{:<8} {:>9} {:>9} {:>9}".format("server", "req/s", "p50 ms",
+                                           "p99 ms"))
+    for name, command in servers:
+        process = subprocess.Popen(command, env=env,
+                                   stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL)
+        try:
+            wait_ready(args.port)
+            stats = load_profile(args.port, session_ids, args.clients,
+                                 args.requests)
+            print("{:<8} {:>9.1f} {:>9.1f} {:>9.1f}".format(
+                name, stats["rps"], stats["p50_ms"], stats["p99_ms"]))
+        finally:
+            process.terminate()
+            process.wait()
+
+
+def bench_threads(args) -> None:
+    """GET /profile req/s of app.py on the threaded Flask server as the
+    number of concurrent clients, hence of request threads, grows."""
+    session_ids = seed_sessions(args.sessions)
+    env = dict(os.environ, DB_PATH=BENCH_DB_PATH, DB_PERSIST="1",
+               SESSION_SWEEP_INTERVAL="0", SESSION_CACHE_SIZE="0")
+    command = [sys.executable, "-c",
+               "from app import app; app.run(host='127.0.0.1', "
+               "port={}, threaded=True)".format(args.port)]
+    print("session cache off, {} CPUs".format(os.cpu_count()))
+    print("{:>8} {:>9} {:>9} {:>9}".format("threads", "req/s", "p50 ms",
+                                           "p99 ms"))
+    for threads in (int(t) for t in args.threads.split(",")):
+        process = subprocess.Popen(command, env=env,
+                                   stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL)
+        try:
+            wait_ready(args.port)
+            stats = load_profile(args.port, session_ids, threads,
+                                 args.requests)
+            print("{:>8} {:>9.1f} {:>9.1f} {:>9.1f}".format(
+                threads, stats["rps"], stats["p50_ms"], stats["p99_ms"]))
+        finally:
+            process.terminate()
+            process.wait()
+
+
+def bench_find(args) -> None:
+    """find_user_by calls/s with the cached statement, against building
+    query(User).filter_by at each call."""
+    from user import User
+    db = fresh_db()
+    emails = seed_users(db, args.rows)
+
+    def cached():
+        db.find_user_by(email=random.choice(emails))
+
+    def rebuilt():
+        # find_user_by before find_user_statement
+        db._session.query(User).filter_by(
+            email=random.choice(emails)).first()
+
+    print("{:<22} {:>12} {:>12}".format("path", "calls/s", "us/call"))
+    for name, func in (("query().filter_by", rebuilt),
+                       ("find_user_statement", cached)):
+        rate = timed(func, args.lookups)
+        print("{:<22} {:>12.1f} {:>12.1f}".format(name, rate, 1e6 / rate))
+
+
+def main() -> None:
+    """Parse the command line and run one benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    index = commands.add_parser("index", help=bench_index.__doc__)
+    index.add_argument("--rows", type=int, default=1000000)
+    index.add_argument("--lookups", type=int, default=5000)
+    index.add_argument("--scan-lookups", type=int, default=20)
+    index.set_defaults(func=bench_index)
+
+    restart = commands.add_parser("restart", help=bench_restart.__doc__)
+    restart.add_argument("--sizes", default="0,10000,100000,1000000")
+    restart.set_defaults(func=bench_restart)
+
+    update = commands.add_parser("update", help=bench_update.__doc__)
+    update.add_argument("--rows", type=int, default=100000)
+    update.add_argument("--updates", type=int, default=5000)
+    update.add_argument("--batch-size", type=int, default=1000)
+    update.set_defaults(func=bench_update)
+
+    register = commands.add_parser("register", help=bench_register.__doc__)
+    register.add_argument("--users", type=int, default=100000)
+    register.add_argument("--bcrypt-rounds", type=int, default=12)
+    register.add_argument("--workers", type=int, default=None)
+    register.set_defaults(func=bench_register)
+
+    profile = commands.add_parser("profile", help=bench_profile.__doc__)
+    profile.add_argument("--sessions", type=int, default=1000)
+    profile.add_argument("--requests", type=int, default=20000)
+    profile.add_argument("--threads", type=int, default=8)
+    profile.set_defaults(func=bench_profile)
+
+    concurrency = commands.add_parser("concurrency",
+                                      help=bench_concurrency.__doc__)
+    concurrency.add_argument("--sessions", type=int, default=1000)
+    concurrency.add_argument("--clients", type=int, default=256)
+    concurrency.add_argument("--requests", type=int, default=5120)
+    concurrency.add_argument("--cache-size", type=int, default=10000,
+                             help="SESSION_CACHE_SIZE, 0 to disable")
+    concurrency.add_argument("--port", type=int, default=5093)
+    concurrency.set_defaults(func=bench_concurrency)
+
+    threads = commands.add_parser("threads", help=bench_threads.__doc__)
+    threads.add_argument("--sessions", type=int, default=1000)
+    threads.add_argument("--threads", default="1,2,4,8")
+    threads.add_argument("--requests", type=int, default=4000)
+    threads.add_argument("--port", type=int, default=5094)
+    threads.set_defaults(func=bench_threads)
+
+    find = commands.add_parser("find", help=bench_find.__doc__)
+    find.add_argument("--rows", type=int, default=10000)
+    find.add_argument("--lookups", type=int, default=20000)
+    find.set_defaults(func=bench_find)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
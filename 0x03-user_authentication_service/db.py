@@ -2,36 +2,220 @@
 """
 DB module
 """
-from sqlalchemy import create_engine
+from os import cpu_count, getenv
+from sqlalchemy import (bindparam, create_engine, delete, event, insert,
+                        select, text, update)
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.orm.session import Session
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy.exc import InvalidRequestError
-from user import Base, User
+from sqlalchemy.exc import IntegrityError, InvalidRequestError
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List
+from datetime import datetime, timedelta
+from user import Base, ResetToken, User, UserSession
+from sql_stats import TimedQueuePool, instrument, totals
 import bcrypt
 
 
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """
+    Tune every new SQLite connection: WAL so that readers do not block
+    the writer, and a larger page cache and memory map
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA cache_size=-{}".format(
+        int(getenv("DB_CACHE_SIZE_KB", "20000"))))
+    cursor.execute("PRAGMA mmap_size={}".format(
+        int(getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))))
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
+
+# Schema changes applied to persistent databases, in order. The schema
+# version is kept in SQLite's user_version pragma.
+MIGRATIONS = [
+    (1, [
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_users_email "
+        "ON users (email)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_users_session_id "
+        "ON users (session_id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_users_reset_token "
+        "ON users (reset_token)",
+    ]),
+    # The sessions table itself is created by create_all
+    (2, [
+        "INSERT OR IGNORE INTO sessions "
+        "(session_id, user_id, created_at, expires_at, last_seen) "
+        "SELECT session_id, id, datetime('now'), datetime('now', '+1 day'), "
+        "datetime('now') FROM users WHERE session_id IS NOT NULL",
+        "UPDATE users SET session_id = NULL",
+    ]),
+    # Raw reset tokens cannot be carried over to reset_tokens
+    (3, [
+        "UPDATE users SET reset_token = NULL",
+    ]),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def prepare_schema(connection) -> None:
+    """
+    Set up the schema on a connection. The database is recreated empty
+    unless DB_PERSIST is set, in which case the existing data is kept,
+    missing tables are created and the MIGRATIONS newer than the schema
+    version of the database are applied.
+    """
+    if getenv("DB_PERSIST", "").lower() not in ("1", "true", "yes"):
+        Base.metadata.drop_all(connection)
+        Base.metadata.create_all(connection)
+        connection.execute(text(
+            "PRAGMA user_version={}".format(SCHEMA_VERSION)))
+        return
+
+    Base.metadata.create_all(connection)
+    version = connection.execute(text("PRAGMA user_version")).scalar()
+    for target, statements in MIGRATIONS:
+        if target <= version:
+            continue
+        for statement in statements:
+            connection.execute(text(statement))
+        connection.execute(text("PRAGMA user_version={}".format(target)))
+
+
+def check_user_attributes(kwargs: dict) -> None:
+    """
+    Raise ValueError if kwargs has keys that are not User columns
+    """
+    invalid_attrs = set(kwargs.keys()) - set(User.__table__.columns.keys())
+    if invalid_attrs:
+        raise ValueError(f"Invalid attribute(s) provided: \
+                         {', '.join(invalid_attrs)}")
+
+
+def delete_expired_batch(table, key, batch_size: int):
+    """
+    DELETE statement removing up to batch_size rows of table past their
+    expires_at, identified by the column key
+    """
+    expired = select(key) \
+        .where(table.c.expires_at <= datetime.utcnow()) \
+        .limit(batch_size).scalar_subquery()
+    return delete(table).where(key.in_(expired))
+
+
+def find_session_statement(session_id: str, now: datetime):
+    """
+    SELECT of the user, expiry and last_seen of a session live at `now`
+    """
+    sessions = UserSession.__table__
+    return select(User, sessions.c.expires_at, sessions.c.last_seen) \
+        .join(sessions, sessions.c.user_id == User.id) \
+        .where(sessions.c.session_id == session_id,
+               sessions.c.expires_at > now)
+
+
+def find_reset_token_statement(token_hash: str):
+    """
+    SELECT of the user ID of a live reset token
+    """
+    tokens = ResetToken.__table__
+    return select(tokens.c.user_id).where(
+        tokens.c.token_hash == token_hash,
+        tokens.c.expires_at > datetime.utcnow())
+
+
+def consume_reset_token_statement(token_hash: str):
+    """
+    DELETE of a live reset token returning its user ID, so that the
+    check and the deletion are one statement
+    """
+    tokens = ResetToken.__table__
+    return delete(tokens).where(
+        tokens.c.token_hash == token_hash,
+        tokens.c.expires_at > datetime.utcnow()).returning(tokens.c.user_id)
+
+
+def reset_password_statements(user_id: int, hashed_password: str) -> list:
+    """
+    Statements setting the password of a user whose reset token was
+    consumed, and deleting the user's other reset tokens
+    """
+    users = User.__table__
+    tokens = ResetToken.__table__
+    return [update(users).where(users.c.id == user_id)
+            .values(hashed_password=hashed_password),
+            delete(tokens).where(tokens.c.user_id == user_id)]
+
+
+# find_user_by statements, keyed by the sorted keyword names and whether
+# each value is None (which compiles to IS NULL rather than a parameter)
+_FIND_USER_STATEMENTS = {}
+
+
+def find_user_statement(kwargs: dict):
+    """
+    Return the SELECT of the first User matching kwargs, and its bound
+    parameters. The statement is built once per set of keyword names and
+    reused, so SQLAlchemy's compiled cache is hit without rebuilding it.
+    Raise InvalidRequestError if a name is not a User attribute.
+    """
+    key = tuple(sorted((name, value is None)
+                       for name, value in kwargs.items()))
+    statement = _FIND_USER_STATEMENTS.get(key)
+    if statement is None:
+        criteria = {name: None if is_null else bindparam(name)
+                    for name, is_null in key}
+        statement = select(User).filter_by(**criteria).limit(1)
+        _FIND_USER_STATEMENTS[key] = statement
+    params = {name: value for name, value in kwargs.items()
+              if value is not None}
+    return statement, params
+
+
 class DB:
     """DB class
     """
 
     def __init__(self) -> None:
         """Initialize a new DB instance
+
+        The database file is DB_PATH (default a.db); see prepare_schema
+        for DB_PERSIST.
         """
-        self._engine = create_engine("sqlite:///a.db", echo=False)
-        Base.metadata.drop_all(self._engine)
-        Base.metadata.create_all(self._engine)
-        self.__session = None
+        self._engine = create_engine(
+            "sqlite:///{}".format(getenv("DB_PATH", "a.db")), echo=False,
+            poolclass=TimedQueuePool,
+            pool_size=int(getenv("DB_POOL_SIZE", "5")),
+            max_overflow=int(getenv("DB_MAX_OVERFLOW", "10")),
+            pool_pre_ping=True,
+            connect_args={"check_same_thread": False})
+        event.listen(self._engine, "connect", _set_sqlite_pragmas)
+        instrument(self._engine)
+        with self._engine.begin() as connection:
+            prepare_schema(connection)
+        self.__session = scoped_session(sessionmaker(bind=self._engine))
 
     @property
     def _session(self) -> Session:
-        """Memoized session object
+        """Session object of the current thread
+        """
+        return self.__session()
+
+    def remove_session(self) -> None:
+        """
+        Close the session of the current thread and return its connection
+        to the pool
         """
-        if self.__session is None:
-            DBSession = sessionmaker(bind=self._engine)
-            self.__session = DBSession()
-        return self.__session
+        self.__session.remove()
+
+    def stats(self) -> dict:
+        """
+        Connection pool statistics and statements run since start
+        """
+        return {"pool": self._engine.pool.stats(), "queries": totals()}
 
     def add_user(self, email: str, hashed_password: str) -> User:
         """
@@ -39,39 +223,219 @@ class DB:
         """
         user = User(email=email, hashed_password=hashed_password)
         self._session.add(user)
-        self._session.commit()
+        try:
+            self._session.commit()
+        except IntegrityError as e:
+            self._session.rollback()
+            raise e
         return user
 
+    def add_users(self, rows: Iterable[Dict], chunk_size: int = 1000,
+                  workers: int = None) -> int:
+        """
+        Bulk add users from dicts holding an email and a clear password.
+        Passwords are hashed in parallel (bcrypt releases the GIL), then
+        rows are inserted chunk_size at a time, one transaction per chunk.
+        Emails that are already registered are skipped.
+        Return the number of users added.
+        """
+        rows = list(rows)
+        workers = workers or cpu_count() or 1
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            hashes = list(executor.map(
+                lambda row: self._hash_password(row["password"]), rows))
+
+        statement = insert(User.__table__).prefix_with(
+            "OR IGNORE", dialect="sqlite")
+        added = 0
+        for start in range(0, len(rows), chunk_size):
+            chunk = [{"email": row["email"], "hashed_password": hashed}
+                     for row, hashed in zip(rows[start:start + chunk_size],
+                                            hashes[start:start + chunk_size])]
+            try:
+                added += self._session.execute(statement, chunk).rowcount
+                self._session.commit()
+            except InvalidRequestError as e:
+                self._session.rollback()
+                raise e
+        return added
+
     def find_user_by(self, **kwargs) -> User:
         """
         Find a user in the database by arbitrary keyword arguments
         """
         try:
-            user = self._session.query(User).filter_by(**kwargs).first()
-            if user is None:
-                raise NoResultFound
-            return user
+            statement, params = find_user_statement(kwargs)
         except InvalidRequestError as e:
             raise e
+        user = self._session.execute(statement, params).scalars().first()
+        if user is None:
+            raise NoResultFound
+        return user
+
+    def add_session(self, user_id: int, session_id: str,
+                    duration: timedelta) -> UserSession:
+        """
+        Add a session of a user lasting `duration`
+        """
+        now = datetime.utcnow()
+        user_session = UserSession(session_id=session_id, user_id=user_id,
+                                   created_at=now, expires_at=now + duration,
+                                   last_seen=now)
+        self._session.add(user_session)
+        self._session.commit()
+        return user_session
+
+    def find_session(self, session_id: str, touch_interval: timedelta):
+        """
+        Find the user and expiry of a live session with one indexed read.
+        last_seen is only written when older than `touch_interval`.
+        Return (user, expires_at) or raise NoResultFound.
+        """
+        now = datetime.utcnow()
+        row = self._session.execute(
+            find_session_statement(session_id, now)).first()
+        if row is None:
+            raise NoResultFound
+        user, expires_at, last_seen = row
+        if now - last_seen >= touch_interval:
+            sessions = UserSession.__table__
+            self._session.execute(
+                update(sessions)
+                .where(sessions.c.session_id == session_id)
+                .values(last_seen=now))
+            self._session.commit()
+        return user, expires_at
+
+    def delete_sessions(self, user_id: int, session_id: str = None) -> None:
+        """
+        Delete one session of a user, or all of them
+        """
+        query = self._session.query(UserSession) \
+            .filter(UserSession.user_id == user_id)
+        if session_id is not None:
+            query = query.filter(UserSession.session_id == session_id)
+        query.delete(synchronize_session=False)
+        self._session.commit()
+
+    def add_reset_token(self, user_id: int, token_hash: str,
+                        duration: timedelta) -> None:
+        """
+        Add the digest of a reset token of a user lasting `duration`
+        """
+        self._session.add(ResetToken(
+            token_hash=token_hash, user_id=user_id,
+            expires_at=datetime.utcnow() + duration))
+        self._session.commit()
+
+    def find_reset_token(self, token_hash: str) -> int:
+        """
+        Return the user ID of a live reset token with one primary key
+        lookup, or raise NoResultFound. Nothing is consumed.
+        """
+        user_id = self._session.execute(
+            find_reset_token_statement(token_hash)).scalar()
+        # Do not hold the read snapshot while the caller hashes
+        self._session.rollback()
+        if user_id is None:
+            raise NoResultFound
+        return user_id
+
+    def reset_password(self, token_hash: str, hashed_password: str) -> int:
+        """
+        In one transaction, consume a live reset token, set its user's
+        password and delete the user's other reset tokens; return the
+        user ID. Only one caller can consume a token; others get
+        NoResultFound. If the update fails the token is kept.
+        """
+        try:
+            user_id = self._session.execute(
+                consume_reset_token_statement(token_hash)).scalar()
+            if user_id is None:
+                raise NoResultFound
+            for statement in reset_password_statements(user_id,
+                                                       hashed_password):
+                self._session.execute(statement)
+            self._session.commit()
+        except Exception:
+            self._session.rollback()
+            raise
+        return user_id
+
+    def purge_expired_sessions(self, batch_size: int = 500) -> int:
+        """
+        Delete expired sessions batch_size rows per transaction so that
+        the write lock is never held for long. Return the rows deleted.
+        """
+        sessions = UserSession.__table__
+        return self._purge_expired(sessions, sessions.c.session_id,
+                                   batch_size)
+
+    def purge_expired_reset_tokens(self, batch_size: int = 500) -> int:
+        """
+        Delete expired reset tokens batch_size rows per transaction.
+        Return the rows deleted.
+        """
+        tokens = ResetToken.__table__
+        return self._purge_expired(tokens, tokens.c.token_hash, batch_size)
+
+    def _purge_expired(self, table, key, batch_size: int) -> int:
+        """
+        Delete the rows of table past their expires_at in batches
+        """
+        deleted = 0
+        while True:
+            result = self._session.execute(
+                delete_expired_batch(table, key, batch_size))
+            self._session.commit()
+            deleted += result.rowcount
+            if result.rowcount < batch_size:
+                return deleted
 
     def update_user(self, user_id: int, **kwargs) -> None:
         """
-        Update a user in the database
+        Update a user in the database with a single UPDATE statement
         """
-        user = self.find_user_by(id=user_id)
+        check_user_attributes(kwargs)
+        if not kwargs:
+            self.find_user_by(id=user_id)
+            return
 
-        # Check if any invalid attribute is passed
-        invalid_attrs = set(kwargs.keys()) - set(User.__table__.columns.keys())
-        if invalid_attrs:
-            raise ValueError(f"Invalid attribute(s) provided: \
-                             {', '.join(invalid_attrs)}")
+        users = User.__table__
+        statement = update(users).where(users.c.id == user_id) \
+            .values(**kwargs)
+        try:
+            result = self._session.execute(statement)
+            if result.rowcount == 0:
+                raise NoResultFound
+            self._session.commit()
+        except (InvalidRequestError, NoResultFound) as e:
+            self._session.rollback()
+            raise e
 
-        # Update user attributes
-        for key, value in kwargs.items():
-            setattr(user, key, value)
+    def update_users(self, batch: List[Dict]) -> None:
+        """
+        Apply many updates in one transaction. Each item of batch holds
+        the user "id" and the columns to set; items setting the same
+        columns are sent together with executemany.
+        """
+        groups = {}
+        for row in batch:
+            values = {k: v for k, v in row.items() if k != "id"}
+            check_user_attributes(values)
+            params = {"b_" + k: v for k, v in values.items()}
+            params["b_id"] = row["id"]
+            groups.setdefault(tuple(sorted(values)), []).append(params)
 
-        # Commit changes to the database
+        users = User.__table__
         try:
+            for columns, rows in groups.items():
+                if not columns:
+                    continue
+                statement = update(users) \
+                    .where(users.c.id == bindparam("b_id")) \
+                    .values({k: bindparam("b_" + k) for k in columns})
+                self._session.execute(statement, rows)
             self._session.commit()
         except InvalidRequestError as e:
             self._session.rollback()
@@ -1,78 +1,151 @@
 #!/usr/bin/env python3
 """
-Main module to test that everything works as expected
+Main module to test that everything works as expected, and to load test
+the service by running the same flow with many concurrent virtual users.
+
+    ./main.py                             # one flow against BASE_URL
+    ./main.py -u 20 -n 5 --save base.json # 20 users, 5 flows each
+    ./main.py -u 20 -n 5 --compare base.json
+    ./main.py --in-process ...            # Flask test client, no server
+
+Start the server with high THROTTLE_IP_BURST/THROTTLE_EMAIL_BURST (and
+matching _RATE) so that logins are not throttled; --in-process sets them
+unless they are already set.
 """
 
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+import time
+import uuid
+
 import requests
 
 BASE_URL = "http://localhost:5000"
 
 
-def register_user(email: str, password: str) -> None:
+class HTTPClient:
+    """Client of a running server over one keep-alive connection."""
+
+    def __init__(self, base_url: str, recorder=None):
+        """Open a session with a single pooled connection."""
+        self.base_url = base_url
+        self.recorder = recorder
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                pool_maxsize=1)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def send(self, method: str, path: str, data: dict = None,
+             session_id: str = None):
+        """Send a request; return (status code, JSON body, session_id)."""
+        cookies = {"session_id": session_id} if session_id else None
+        started = time.perf_counter()
+        response = self.session.request(method, self.base_url + path,
+                                        data=data, cookies=cookies)
+        elapsed = time.perf_counter() - started
+        # Only the cookies passed explicitly are sent
+        self.session.cookies.clear()
+        if self.recorder is not None:
+            self.recorder.record(method, path, response.status_code, elapsed)
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        return (response.status_code, body,
+                response.cookies.get("session_id"))
+
+
+class InProcessClient:
+    """Client calling the app through the Flask test client."""
+
+    def __init__(self, app, recorder=None):
+        """Create a test client that does not keep cookies."""
+        self.recorder = recorder
+        self.client = app.test_client(use_cookies=False)
+
+    def send(self, method: str, path: str, data: dict = None,
+             session_id: str = None):
+        """Send a request; return (status code, JSON body, session_id)."""
+        headers = {"Cookie": "session_id=" + session_id} \
+            if session_id else None
+        started = time.perf_counter()
+        response = self.client.open(path, method=method, data=data,
+                                    headers=headers, follow_redirects=True)
+        elapsed = time.perf_counter() - started
+        if self.recorder is not None:
+            self.recorder.record(method, path, response.status_code, elapsed)
+        cookie = SimpleCookie()
+        for header in response.headers.getlist("Set-Cookie"):
+            cookie.load(header)
+        session = cookie.get("session_id")
+        return (response.status_code, response.get_json(silent=True),
+                session.value if session else None)
+
+
+def register_user(client, email: str, password: str) -> None:
     """Register a new user with the given email and password."""
-    url = f"{BASE_URL}/users"
-    data = {"email": email, "password": password}
-    response = requests.post(url, data=data)
-    assert response.status_code == 200
+    status, _, _ = client.send("POST", "/users",
+                               {"email": email, "password": password})
+    assert status == 200
 
 
-def log_in_wrong_password(email: str, password: str) -> None:
+def log_in_wrong_password(client, email: str, password: str) -> None:
     """Attempt to log in with the wrong password."""
-    url = f"{BASE_URL}/sessions"
-    data = {"email": email, "password": password}
-    response = requests.post(url, data=data)
-    assert response.status_code == 401
+    status, _, _ = client.send("POST", "/sessions",
+                               {"email": email, "password": password})
+    assert status == 401
 
 
-def log_in(email: str, password: str) -> str:
+def log_in(client, email: str, password: str) -> str:
     """Log in with the correct email and password and return the session ID."""
-    url = f"{BASE_URL}/sessions"
-    data = {"email": email, "password": password}
-    response = requests.post(url, data=data)
-    assert response.status_code == 200
-    return response.cookies.get("session_id")
+    status, _, session_id = client.send("POST", "/sessions",
+                                        {"email": email,
+                                         "password": password})
+    assert status == 200
+    return session_id
 
 
-def profile_unlogged() -> None:
+def profile_unlogged(client) -> None:
     """Attempt to access the profile page without logging in."""
-    url = f"{BASE_URL}/profile"
-    response = requests.get(url)
-    assert response.status_code == 403
+    status, _, _ = client.send("GET", "/profile")
+    assert status == 403
 
 
-def profile_logged(session_id: str) -> None:
+def profile_logged(client, session_id: str, email: str) -> None:
     """Access the profile page after logging in."""
-    url = f"{BASE_URL}/profile"
-    cookies = {"session_id": session_id}
-    response = requests.get(url, cookies=cookies)
-    assert response.status_code == 200
-    assert response.json()["email"] == EMAIL
+    status, body, _ = client.send("GET", "/profile", session_id=session_id)
+    assert status == 200
+    assert body["email"] == email
 
 
-def log_out(session_id: str) -> None:
+def log_out(client, session_id: str) -> None:
     """Log out by deleting the session."""
-    url = f"{BASE_URL}/sessions"
-    cookies = {"session_id": session_id}
-    response = requests.delete(url, cookies=cookies)
-    assert response.status_code == 200
+    status, _, _ = client.send("DELETE", "/sessions", session_id=session_id)
+    assert status == 200
 
 
-def reset_password_token(email: str) -> str:
+def reset_password_token(client, email: str) -> str:
     """Get a reset password token for the given email."""
-    url = f"{BASE_URL}/reset_password"
-    data = {"email": email}
-    response = requests.post(url, data=data)
-    assert response.status_code == 200
-    return response.json()["reset_token"]
+    status, body, _ = client.send("POST", "/reset_password",
+                                  {"email": email})
+    assert status == 200
+    return body["reset_token"]
 
 
-def update_password(email: str, reset_token: str, new_password: str) -> None:
+def update_password(client, email: str, reset_token: str,
+                    new_password: str) -> None:
     """Update the password using the reset token."""
-    url = f"{BASE_URL}/reset_password"
-    data = {"email": email, "reset_token": reset_token,
-            "new_password": new_password}
-    response = requests.put(url, data=data)
-    assert response.status_code == 200
+    status, _, _ = client.send("PUT", "/reset_password",
+                               {"email": email, "reset_token": reset_token,
+                                "new_password": new_password})
+    assert status == 200
 
 
 EMAIL = "guillaume@holberton.io"
@@ -80,13 +153,181 @@ PASSWD = "b4l0u"
 NEW_PASSWD = "t4rt1fl3tt3"
 
 
+def run_flow(client, email: str) -> None:
+    """Run the end-to-end flow once for a new user."""
+    register_user(client, email, PASSWD)
+    log_in_wrong_password(client, email, NEW_PASSWD)
+    profile_unlogged(client)
+    session_id = log_in(client, email, PASSWD)
+    profile_logged(client, session_id, email)
+    log_out(client, session_id)
+    reset_token = reset_password_token(client, email)
+    update_password(client, email, reset_token, NEW_PASSWD)
+    log_in(client, email, NEW_PASSWD)
+
+
+class Recorder:
+    """Latencies and status codes of requests, per endpoint."""
+
+    def __init__(self):
+        """Start with no samples."""
+        self.latencies = {}
+        self.statuses = {}
+        self.failed_flows = 0
+        self._lock = threading.Lock()
+
+    def record(self, method: str, path: str, status: int,
+               elapsed: float) -> None:
+        """Record one request."""
+        endpoint = method + " " + path
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(elapsed)
+            statuses = self.statuses.setdefault(endpoint, {})
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    def flow_failed(self) -> None:
+        """Count a flow that got an unexpected response."""
+        with self._lock:
+            self.failed_flows += 1
+
+
+def percentile(samples: list, p: float) -> float:
+    """Nearest-rank percentile of sorted samples."""
+    if not samples:
+        return 0.0
+    return samples[max(0, math.ceil(p / 100 * len(samples)) - 1)]
+
+
+def report(recorder: Recorder, elapsed: float, users: int,
+           iterations: int, mode: str) -> dict:
+    """Summarise a run: throughput and latency percentiles per endpoint."""
+    endpoints = {}
+    for endpoint, samples in sorted(recorder.latencies.items()):
+        samples = sorted(samples)
+        endpoints[endpoint] = {
+            "count": len(samples),
+            "statuses": recorder.statuses[endpoint],
+            "rps": round(len(samples) / elapsed, 2),
+            "p50_ms": round(percentile(samples, 50) * 1000, 2),
+            "p95_ms": round(percentile(samples, 95) * 1000, 2),
+            "p99_ms": round(percentile(samples, 99) * 1000, 2),
+        }
+    return {"mode": mode, "users": users, "iterations": iterations,
+            "elapsed_s": round(elapsed, 3),
+            "failed_flows": recorder.failed_flows, "endpoints": endpoints}
+
+
+def print_report(summary: dict) -> None:
+    """Print a report as a table."""
+    print("{} users x {} flows ({}) in {}s, {} failed flows".format(
+        summary["users"], summary["iterations"], summary["mode"],
+        summary["elapsed_s"], summary["failed_flows"]))
+    print("{:<22} {:>7} {:>9} {:>9} {:>9} {:>9}  {}".format(
+        "endpoint", "count", "req/s", "p50 ms", "p95 ms", "p99 ms",
+        "statuses"))
+    for endpoint, stats in summary["endpoints"].items():
+        print("{:<22} {:>7} {:>9} {:>9} {:>9} {:>9}  {}".format(
+            endpoint, stats["count"], stats["rps"], stats["p50_ms"],
+            stats["p95_ms"], stats["p99_ms"], stats["statuses"]))
+
+
+def compare(summary: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Return the regressions of a run against a baseline: endpoints whose
+    p95 latency grew, or whose throughput dropped, by more than tolerance
+    """
+    regressions = []
+    for endpoint, base in baseline["endpoints"].items():
+        stats = summary["endpoints"].get(endpoint)
+        if stats is None:
+            regressions.append("{}: not requested".format(endpoint))
+            continue
+        if stats["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append("{}: p95 {}ms > baseline {}ms".format(
+                endpoint, stats["p95_ms"], base["p95_ms"]))
+        if stats["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append("{}: {} req/s < baseline {} req/s".format(
+                endpoint, stats["rps"], base["rps"]))
+    if summary["failed_flows"] > baseline["failed_flows"]:
+        regressions.append("failed flows: {} > baseline {}".format(
+            summary["failed_flows"], baseline["failed_flows"]))
+    return regressions
+
+
+def load_test(make_client, users: int, iterations: int,
+              recorder: Recorder) -> float:
+    """
+    Run `iterations` flows for each of `users` concurrent virtual users,
+    each with its own client; return the wall time in seconds
+    """
+    run_id = uuid.uuid4().hex[:8]
+
+    def virtual_user(number: int) -> None:
+        client = make_client()
+        for iteration in range(iterations):
+            email = "{}.{}.{}.{}".format(run_id, number, iteration, EMAIL)
+            try:
+                run_flow(client, email)
+            except (AssertionError, KeyError, TypeError,
+                    requests.RequestException):
+                recorder.flow_failed()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as executor:
+        list(executor.map(virtual_user, range(users)))
+    return time.perf_counter() - started
+
+
+def main() -> int:
+    """Parse the command line, run the load test and report."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("-u", "--users", type=int, default=1,
+                        help="concurrent virtual users")
+    parser.add_argument("-n", "--iterations", type=int, default=1,
+                        help="flows run by each virtual user")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--in-process", action="store_true",
+                        help="call app.py through the Flask test client")
+    parser.add_argument("--save", metavar="PATH",
+                        help="write the results as a JSON baseline")
+    parser.add_argument("--compare", metavar="PATH",
+                        help="fail if slower than this JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed relative regression (default 0.2)")
+    args = parser.parse_args()
+
+    recorder = Recorder()
+    if args.in_process:
+        for name in ("THROTTLE_IP_BURST", "THROTTLE_IP_RATE",
+                     "THROTTLE_EMAIL_BURST", "THROTTLE_EMAIL_RATE"):
+            os.environ.setdefault(name, "1000000")
+        from app import app
+        mode = "in-process"
+
+        def make_client():
+            return InProcessClient(app, recorder)
+    else:
+        mode = args.base_url
+
+        def make_client():
+            return HTTPClient(args.base_url, recorder)
+
+    elapsed = load_test(make_client, args.users, args.iterations, recorder)
+    summary = report(recorder, elapsed, args.users, args.iterations, mode)
+    print_report(summary)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(summary, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(summary, json.load(f), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        if regressions:
+            return 1
+    return 1 if summary["failed_flows"] else 0
+
+
 if __name__ == "__main__":
-    register_user(EMAIL, PASSWD)
-    log_in_wrong_password(EMAIL, NEW_PASSWD)
-    profile_unlogged()
-    session_id = log_in(EMAIL, PASSWD)
-    profile_logged(session_id)
-    log_out(session_id)
-    reset_token = reset_password_token(EMAIL)
-    update_password(EMAIL, reset_token, NEW_PASSWD)
-    log_in(EMAIL, NEW_PASSWD)
+    sys.exit(main())
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Password hashing pool module
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import bcrypt
+import os
+import threading
+import time
+
+
+class PasswordPoolOverloaded(Exception):
+    """
+    Raised when too many password operations are already queued
+    """
+
+
+class _Timing:
+    """
+    Count, total and maximum of a duration
+    """
+
+    def __init__(self):
+        """
+        Initialise empty counters
+        """
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        """
+        Record one duration
+        """
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def to_dict(self) -> dict:
+        """
+        Return the counters as a dictionary
+        """
+        return {"count": self.count, "total": self.total, "max": self.max}
+
+
+class PasswordPool:
+    """
+    Bounded thread pool running bcrypt off the request threads (bcrypt
+    releases the GIL). At most `workers + queue_depth` operations are
+    accepted at once; beyond that PasswordPoolOverloaded is raised
+    right away instead of letting latency grow.
+    """
+
+    def __init__(self, workers: int = None, queue_depth: int = None):
+        """
+        Initialise the pool from HASH_WORKERS and HASH_QUEUE_DEPTH
+        """
+        if workers is None:
+            workers = int(os.getenv("HASH_WORKERS", os.cpu_count() or 1))
+        if queue_depth is None:
+            queue_depth = int(os.getenv("HASH_QUEUE_DEPTH", workers * 4))
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix="bcrypt")
+        self._slots = threading.BoundedSemaphore(workers + queue_depth)
+        self._lock = threading.Lock()
+        self.queue_time = _Timing()
+        self.run_time = _Timing()
+        self.rejected = 0
+
+    def _submit(self, func, *args):
+        """
+        Queue func on the pool and return its future
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PasswordPoolOverloaded
+
+        submitted = time.perf_counter()
+
+        def timed():
+            started = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                ended = time.perf_counter()
+                with self._lock:
+                    self.queue_time.add(started - submitted)
+                    self.run_time.add(ended - started)
+
+        future = self._executor.submit(timed)
+        future.add_done_callback(lambda f: self._slots.release())
+        return future
+
+    def _run(self, func, *args):
+        """
+        Run func on the pool and wait for its result
+        """
+        return self._submit(func, *args).result()
+
+    async def _run_async(self, func, *args):
+        """
+        Run func on the pool without blocking the event loop
+        """
+        return await asyncio.wrap_future(self._submit(func, *args))
+
+    def hash(self, password: str) -> bytes:
+        """
+        Hash a password with a new salt
+        """
+        return self._run(lambda: bcrypt.hashpw(password.encode('utf-8'),
+                                               bcrypt.gensalt()))
+
+    def check(self, password: str, hashed_password: bytes) -> bool:
+        """
+        Check a password against its hash
+        """
+        return self._run(bcrypt.checkpw, password.encode('utf-8'),
+                         hashed_password)
+
+    async def hash_async(self, password: str) -> bytes:
+        """
+        Hash a password with a new salt from a coroutine
+        """
+        return await self._run_async(
+            lambda: bcrypt.hashpw(password.encode('utf-8'),
+                                  bcrypt.gensalt()))
+
+    async def check_async(self, password: str,
+                          hashed_password: bytes) -> bool:
+        """
+        Check a password against its hash from a coroutine
+        """
+        return await self._run_async(bcrypt.checkpw,
+                                     password.encode('utf-8'),
+                                     hashed_password)
+
+    def stats(self) -> dict:
+        """
+        Return queue time, run time and rejection counters
+        """
+        with self._lock:
+            return {"queue_time": self.queue_time.to_dict(),
+                    "run_time": self.run_time.to_dict(),
+                    "rejected": self.rejected}
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Session cache module
+"""
+
+from collections import OrderedDict, namedtuple
+import threading
+import time
+
+
+UserSnapshot = namedtuple("UserSnapshot", ["id", "email"])
+MISSING = object()
+
+
+class SessionCache:
+    """
+    Bounded LRU cache with TTL mapping a session ID to a UserSnapshot,
+    or to None for session IDs known not to exist (negative entries).
+
+    A reader that misses takes generation() before reading the database
+    and passes it to put(), which discards the result if the session or
+    its user was invalidated in between: a logout racing with a lookup
+    cannot leave the logged-out session cached.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 30):
+        """
+        Initialise an empty cache
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._by_user = {}
+        self._lock = threading.Lock()
+        # Invalidation counter, and the counter value of the latest
+        # invalidation of recent ("session", id) / ("user", id) keys;
+        # older records are forgotten, raising the floor below which a
+        # reader's generation is considered stale
+        self._generation = 0
+        self._invalidations = OrderedDict()
+        self._floor = 0
+
+    def get(self, session_id: str):
+        """
+        Return the cached snapshot, None for a negative entry, or MISSING
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    self._drop(session_id)
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(session_id)
+            if entry[1] is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return entry[1]
+
+    def generation(self) -> int:
+        """
+        Return the current generation, to pass to put() after a read
+        """
+        with self._lock:
+            return self._generation
+
+    def put(self, session_id: str, snapshot: UserSnapshot = None,
+            ttl: float = None, generation: int = None) -> None:
+        """
+        Cache the snapshot of a session, or a negative entry, for `ttl`
+        seconds at most (the cache TTL by default). With a generation,
+        nothing is cached if the session or its user was invalidated
+        since generation() returned it.
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            if generation is not None and \
+                    self._stale(session_id, snapshot, generation):
+                return
+            self._drop(session_id)
+            self._entries[session_id] = (time.monotonic() + ttl, snapshot)
+            if snapshot is not None:
+                self._by_user.setdefault(snapshot.id, set()).add(session_id)
+            while len(self._entries) > self.max_size:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, session_id: str) -> None:
+        """
+        Forget a session ID
+        """
+        with self._lock:
+            self._record_invalidation(("session", session_id))
+            self._drop(session_id)
+
+    def invalidate_user(self, user_id: int) -> None:
+        """
+        Forget every session of a user
+        """
+        with self._lock:
+            self._record_invalidation(("user", user_id))
+            for session_id in list(self._by_user.get(user_id, ())):
+                self._drop(session_id)
+
+    def _record_invalidation(self, key: tuple) -> None:
+        """
+        Start a new generation and record it for key; the lock must be
+        held
+        """
+        self._generation += 1
+        self._invalidations[key] = self._generation
+        self._invalidations.move_to_end(key)
+        while len(self._invalidations) > max(self.max_size, 1):
+            _, generation = self._invalidations.popitem(last=False)
+            self._floor = max(self._floor, generation)
+
+    def _stale(self, session_id: str, snapshot: UserSnapshot,
+               generation: int) -> bool:
+        """
+        Whether an invalidation may have happened after `generation` for
+        this session or its user; the lock must be held
+        """
+        if generation < self._floor:
+            return True
+        if self._invalidations.get(("session", session_id), 0) > generation:
+            return True
+        return snapshot is not None and \
+            self._invalidations.get(("user", snapshot.id), 0) > generation
+
+    def _drop(self, session_id: str) -> None:
+        """
+        Remove an entry and its user index; the lock must be held
+        """
+        entry = self._entries.pop(session_id, None)
+        if entry is None or entry[1] is None:
+            return
+        sessions = self._by_user.get(entry[1].id)
+        if sessions is not None:
+            sessions.discard(session_id)
+            if not sessions:
+                del self._by_user[entry[1].id]
+
+    def stats(self) -> dict:
+        """
+        Return hit and miss counters and the hit rate
+        """
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.negative_hits) / lookups
+            if lookups else 0.0,
+            "size": len(self._entries),
+        }
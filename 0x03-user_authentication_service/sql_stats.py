@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+SQL instrumentation module: per-request query counts and DB time, a
+slow-query log with redacted parameters, and connection pool statistics
+"""
+
+import contextvars
+import logging
+import os
+import threading
+import time
+import typing
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+
+# Parameter names containing any of these are redacted in the slow-query
+# log, whatever prefix or suffix SQLAlchemy gives them (email_1,
+# b_hashed_password...)
+PII_FIELDS: typing.Tuple[str, ...] = ('email', 'password', 'session_id',
+                                      'token')
+REDACTION = "***"
+
+
+def redact(params: dict) -> dict:
+    """
+    Copy of the bound parameters of a statement with the values of the
+    PII_FIELDS parameters replaced by REDACTION
+    """
+    return {name: REDACTION if any(field in name.lower()
+                                   for field in PII_FIELDS) else value
+            for name, value in params.items()}
+
+
+def get_logger() -> logging.Logger:
+    """
+    Return the slow-query logger, writing to stderr
+    """
+    logger = logging.getLogger("slow_query")
+    if not logger.handlers:
+        logger.setLevel(logging.WARNING)
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(logging.Formatter(
+            "[SQL] %(name)s %(levelname)s %(asctime)-15s: %(message)s"))
+        logger.addHandler(stream_handler)
+        logger.propagate = False
+    return logger
+
+
+class QueryStats:
+    """
+    Number of statements and time spent running them
+    """
+
+    __slots__ = ("count", "seconds")
+
+    def __init__(self):
+        """
+        Initialise empty stats
+        """
+        self.count = 0
+        self.seconds = 0.0
+
+
+# Stats of the current request; a context variable so that both threads
+# and asyncio tasks get their own
+_request_stats = contextvars.ContextVar("request_stats", default=None)
+_totals = {"queries": 0, "slow_queries": 0, "seconds": 0.0}
+_totals_lock = threading.Lock()
+
+
+def begin_request() -> None:
+    """
+    Start counting the statements of the current request
+    """
+    _request_stats.set(QueryStats())
+
+
+def end_request() -> QueryStats:
+    """
+    Stop counting and return the stats of the current request, or None
+    if begin_request was not called
+    """
+    stats = _request_stats.get()
+    _request_stats.set(None)
+    return stats
+
+
+def totals() -> dict:
+    """
+    Statements run and time spent since start, over all requests
+    """
+    with _totals_lock:
+        return dict(_totals)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany) -> None:
+    """
+    Remember when the statement started, on its execution context so
+    that nothing is left behind if it fails
+    """
+    if context is not None:
+        context.sql_stats_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany) -> None:
+    """
+    Count the statement and log it if slow
+    """
+    started = getattr(context, "sql_stats_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.count += 1
+        stats.seconds += elapsed
+    slow = elapsed * 1000 >= SLOW_QUERY_MS
+    with _totals_lock:
+        _totals["queries"] += 1
+        _totals["seconds"] += elapsed
+        if slow:
+            _totals["slow_queries"] += 1
+    if slow:
+        _log_slow_query(statement, context, elapsed)
+
+
+def _log_slow_query(statement: str, context, elapsed: float) -> None:
+    """
+    Log a slow statement with the parameters of its first row, the
+    sensitive ones redacted by name
+    """
+    message = "duration_ms={:.1f} statement={}".format(
+        elapsed * 1000, " ".join(statement.split()))
+    params = getattr(context, "compiled_parameters", None) or []
+    if len(params) > 1:
+        message += " rows={}".format(len(params))
+    if params:
+        message += " params={!r}".format(redact(params[0]))
+    get_logger().warning(message)
+
+
+def instrument(engine) -> None:
+    """
+    Count and time every statement run on a (sync) engine
+    """
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool recording how many connections were checked out and how
+    long callers waited to get one
+    """
+
+    def __init__(self, *args, **kwargs):
+        """
+        Initialise the pool and its counters
+        """
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self._stats_lock = threading.Lock()
+
+    def _do_get(self):
+        """
+        Check out a connection, timing the wait
+        """
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_seconds += waited
+                self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def stats(self) -> dict:
+        """
+        Pool occupancy and checkout wait statistics
+        """
+        with self._stats_lock:
+            return {"size": self.size(),
+                    "checked_out": self.checkedout(),
+                    "overflow": self.overflow(),
+                    "checkouts": self.checkouts,
+                    "wait_ms_total": round(self.wait_seconds * 1000, 3),
+                    "wait_ms_max": round(self.max_wait_seconds * 1000, 3)}
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Tests of the app module
+"""
+import importlib
+import sys
+import threading
+
+import pytest
+
+from password_pool import PasswordPool
+
+
+@pytest.fixture
+def app_module(tmp_path, monkeypatch):
+    """ The app module on an empty database file under tmp_path, without
+    the session sweeper
+    """
+    monkeypatch.setenv("DB_PATH", str(tmp_path / "test.db"))
+    monkeypatch.delenv("DB_PERSIST", raising=False)
+    monkeypatch.setenv("SESSION_SWEEP_INTERVAL", "0")
+    if "app" in sys.modules:
+        app = importlib.reload(sys.modules["app"])
+    else:
+        app = importlib.import_module("app")
+    yield app
+    app.AUTH._db.remove_session()
+    app.AUTH._db._engine.dispose()
+
+
+def test_saturated_password_pool_returns_503(app_module, monkeypatch):
+    """ When every worker and queue slot of the password pool is taken,
+    registering fails fast with 503 and Retry-After
+    """
+    pool = PasswordPool(workers=1, queue_depth=0)
+    monkeypatch.setattr(app_module.AUTH, "passwords", pool)
+    release = threading.Event()
+    blocking = pool._submit(release.wait)
+    try:
+        response = app_module.app.test_client().post(
+            "/users", data={"email": "bob@hbtn.io", "password": "pwd"})
+    finally:
+        release.set()
+        blocking.result()
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert pool.stats()["rejected"] == 1
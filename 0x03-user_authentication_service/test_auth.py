@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Tests of the Auth module
+"""
+import pytest
+
+from auth import Auth
+
+
+@pytest.fixture
+def auth(tmp_path, monkeypatch):
+    """ An Auth on an empty database file under tmp_path, counting the
+    passwords it hashes
+    """
+    monkeypatch.setenv("DB_PATH", str(tmp_path / "test.db"))
+    monkeypatch.delenv("DB_PERSIST", raising=False)
+    auth = Auth()
+    auth.hashed = []
+    hash_password = auth.passwords.hash
+    monkeypatch.setattr(auth.passwords, "hash", lambda password: (
+        auth.hashed.append(password) or hash_password(password)))
+    yield auth
+    auth._db.remove_session()
+    auth._db._engine.dispose()
+
+
+def test_update_password_checks_token_before_hashing(auth):
+    """ An unknown reset token is rejected without hashing anything
+    """
+    with pytest.raises(ValueError):
+        auth.update_password("unknown", "new password")
+    assert auth.hashed == []
+
+
+def test_update_password_revokes_other_tokens(auth):
+    """ After a reset, no outstanding token of the user works
+    """
+    auth._db.add_user("bob@hbtn.io", "old")
+    first = auth.get_reset_password_token("bob@hbtn.io")
+    second = auth.get_reset_password_token("bob@hbtn.io")
+    auth.update_password(second, "new password")
+    assert auth.hashed == ["new password"]
+    with pytest.raises(ValueError):
+        auth.update_password(first, "other password")
+    assert auth.valid_login("bob@hbtn.io", "new password")
+
+
+def test_user_keeps_several_sessions(auth):
+    """ Each login opens its own session; earlier ones stay valid
+    """
+    user = auth._db.add_user("bob@hbtn.io", "old")
+    session_ids = [auth.create_session("bob@hbtn.io") for _ in range(3)]
+    assert len(set(session_ids)) == 3
+    for session_id in session_ids:
+        assert auth.get_user_from_session_id(session_id).id == user.id
+
+
+def test_destroy_session_keeps_other_sessions(auth):
+    """ Logging out of one session leaves the user's others valid, even
+    when they are cached
+    """
+    user = auth._db.add_user("bob@hbtn.io", "old")
+    first = auth.create_session("bob@hbtn.io")
+    second = auth.create_session("bob@hbtn.io")
+    for session_id in (first, second):
+        auth.get_user_from_session_id(session_id)
+    auth.destroy_session(user.id, first)
+    assert auth.get_user_from_session_id(first) is None
+    assert auth.get_user_from_session_id(second).id == user.id
+
+
+def test_destroy_all_sessions(auth):
+    """ Without a session ID, every session of the user is destroyed
+    """
+    user = auth._db.add_user("bob@hbtn.io", "old")
+    other = auth._db.add_user("alice@hbtn.io", "old")
+    session_ids = [auth.create_session("bob@hbtn.io") for _ in range(2)]
+    kept = auth.create_session("alice@hbtn.io")
+    for session_id in session_ids + [kept]:
+        auth.get_user_from_session_id(session_id)
+    auth.destroy_session(user.id)
+    for session_id in session_ids:
+        assert auth.get_user_from_session_id(session_id) is None
+    assert auth.get_user_from_session_id(kept).id == other.id
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Tests of the DB module
+"""
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm.exc import NoResultFound
+
+import db as db_module
+from db import (DB, find_reset_token_statement, find_session_statement,
+                find_user_statement)
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """ A DB on an empty database file under tmp_path
+    """
+    monkeypatch.setenv("DB_PATH", str(tmp_path / "test.db"))
+    monkeypatch.delenv("DB_PERSIST", raising=False)
+    db = DB()
+    yield db
+    db.remove_session()
+    db._engine.dispose()
+
+
+def query_plan(db: DB, statement, params: dict = None) -> str:
+    """ SQLite's EXPLAIN QUERY PLAN of a statement
+    """
+    compiled = statement.compile(db._engine)
+    values = compiled.construct_params(params)
+    args = tuple(values[name] for name in compiled.positiontup)
+    with db._engine.connect() as connection:
+        rows = connection.exec_driver_sql(
+            "EXPLAIN QUERY PLAN " + compiled.string, args)
+        return " ".join(row[-1] for row in rows)
+
+
+def test_find_user_by_email_uses_index(db):
+    """ Login lookups use the email index
+    """
+    plan = query_plan(db, *find_user_statement({"email": "value"}))
+    assert "USING INDEX ix_users_email" in plan
+    assert not plan.startswith("SCAN")
+
+
+def test_find_user_by_id_uses_primary_key(db):
+    """ Lookups by id use the integer primary key
+    """
+    plan = query_plan(db, *find_user_statement({"id": 1}))
+    assert "USING INTEGER PRIMARY KEY" in plan
+
+
+def test_find_session_uses_primary_keys(db):
+    """ Session lookups read one sessions row by its key, then its user
+    """
+    plan = query_plan(db, find_session_statement("value", datetime.utcnow()))
+    assert "SEARCH sessions USING INDEX sqlite_autoindex_sessions_1" in plan
+    assert "SEARCH users USING INTEGER PRIMARY KEY" in plan
+    assert "SCAN" not in plan
+
+
+def test_find_reset_token_uses_primary_key(db):
+    """ Reset token lookups read one reset_tokens row by its key
+    """
+    plan = query_plan(db, find_reset_token_statement("a" * 64))
+    assert "SEARCH reset_tokens USING INDEX sqlite_autoindex_reset_tokens_1" \
+        in plan
+    assert "SCAN" not in plan
+
+
+def add_user_with_tokens(db: DB, *token_hashes: str) -> int:
+    """ Add a user with live reset tokens; return its ID
+    """
+    user = db.add_user("bob@hbtn.io", "old")
+    for token_hash in token_hashes:
+        db.add_reset_token(user.id, token_hash, timedelta(hours=1))
+    return user.id
+
+
+def test_reset_password_consumes_every_token(db):
+    """ A reset sets the password and deletes the user's other tokens
+    """
+    user_id = add_user_with_tokens(db, "a" * 64, "b" * 64)
+    assert db.reset_password("a" * 64, "new") == user_id
+    assert db.find_user_by(id=user_id).hashed_password == "new"
+    for token_hash in ("a" * 64, "b" * 64):
+        with pytest.raises(NoResultFound):
+            db.find_reset_token(token_hash)
+
+
+def test_failed_reset_keeps_token(db, monkeypatch):
+    """ The token is only consumed if the password update succeeds
+    """
+    user_id = add_user_with_tokens(db, "a" * 64)
+    monkeypatch.setattr(db_module, "reset_password_statements",
+                        lambda *args: [text("UPDATE missing SET x = 1")])
+    with pytest.raises(OperationalError):
+        db.reset_password("a" * 64, "new")
+    assert db.find_reset_token("a" * 64) == user_id
+    assert db.find_user_by(id=user_id).hashed_password == "old"
+
+
+def test_purge_expired_sessions_in_batches(db, monkeypatch):
+    """ Expired sessions are deleted batch_size rows per statement and
+    live sessions are kept
+    """
+    user = db.add_user("bob@hbtn.io", "old")
+    for i in range(5):
+        db.add_session(user.id, "expired{}".format(i), timedelta(seconds=-1))
+    db.add_session(user.id, "live", timedelta(hours=1))
+    batches = []
+    delete_expired_batch = db_module.delete_expired_batch
+    monkeypatch.setattr(db_module, "delete_expired_batch", lambda *args: (
+        batches.append(args[-1]) or delete_expired_batch(*args)))
+    assert db.purge_expired_sessions(batch_size=2) == 5
+    assert batches == [2, 2, 2]
+    remaining = db._session.execute(
+        text("SELECT session_id FROM sessions")).scalars().all()
+    assert remaining == ["live"]
+
+
+def test_purge_expired_reset_tokens(db):
+    """ Expired reset tokens are deleted, live ones are kept
+    """
+    user_id = add_user_with_tokens(db, "a" * 64)
+    db.add_reset_token(user_id, "b" * 64, timedelta(seconds=-1))
+    assert db.purge_expired_reset_tokens(batch_size=1) == 1
+    assert db.find_reset_token("a" * 64) == user_id
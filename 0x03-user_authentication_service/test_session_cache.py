@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Tests of the session cache
+"""
+from session_cache import MISSING, SessionCache, UserSnapshot
+
+
+def test_put_after_invalidate_is_dropped():
+    """ A snapshot read before a logout is not cached after it
+    """
+    cache = SessionCache()
+    generation = cache.generation()
+    cache.invalidate("sid")
+    cache.put("sid", UserSnapshot(1, "bob@hbtn.io"), generation=generation)
+    assert cache.get("sid") is MISSING
+
+
+def test_put_after_invalidate_user_is_dropped():
+    """ A snapshot read before a password reset is not cached after it
+    """
+    cache = SessionCache()
+    generation = cache.generation()
+    cache.invalidate_user(1)
+    cache.put("sid", UserSnapshot(1, "bob@hbtn.io"), generation=generation)
+    assert cache.get("sid") is MISSING
+
+
+def test_put_unrelated_to_invalidation_is_kept():
+    """ Invalidating other sessions and users does not drop a read
+    """
+    cache = SessionCache()
+    generation = cache.generation()
+    cache.invalidate("other")
+    cache.invalidate_user(2)
+    snapshot = UserSnapshot(1, "bob@hbtn.io")
+    cache.put("sid", snapshot, generation=generation)
+    assert cache.get("sid") == snapshot
+
+
+def test_put_older_than_forgotten_invalidations_is_dropped():
+    """ Once an invalidation is forgotten, older reads are not trusted
+    """
+    cache = SessionCache(max_size=2)
+    generation = cache.generation()
+    for session_id in ("a", "b", "c"):
+        cache.invalidate(session_id)
+    cache.put("sid", UserSnapshot(1, "bob@hbtn.io"), generation=generation)
+    assert cache.get("sid") is MISSING
+    cache.put("sid", UserSnapshot(1, "bob@hbtn.io"),
+              generation=cache.generation())
+    assert cache.get("sid") is not MISSING
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Tests of the SQL instrumentation module
+"""
+import logging
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+import sql_stats
+
+
+@pytest.fixture
+def engine():
+    """ An instrumented in-memory SQLite engine
+    """
+    engine = create_engine("sqlite://")
+    sql_stats.instrument(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def slow_log(monkeypatch):
+    """ Messages written to the slow-query log
+    """
+    messages = []
+    handler = logging.Handler()
+    handler.emit = lambda record: messages.append(record.getMessage())
+    logger = sql_stats.get_logger()
+    logger.addHandler(handler)
+    yield messages
+    logger.removeHandler(handler)
+
+
+def test_statements_are_counted_per_request(engine):
+    """ Only the statements run between begin_request and end_request
+    are counted
+    """
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+        sql_stats.begin_request()
+        for _ in range(3):
+            connection.execute(text("SELECT 1"))
+        stats = sql_stats.end_request()
+        connection.execute(text("SELECT 1"))
+    assert stats.count == 3
+    assert stats.seconds > 0
+    assert sql_stats.end_request() is None
+
+
+def test_failed_statement_is_not_counted(engine):
+    """ A failing statement is not counted and leaves nothing behind on
+    its connection
+    """
+    with engine.connect() as connection:
+        info = dict(connection.info)
+        sql_stats.begin_request()
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                connection.execute(text("SELECT * FROM missing"))
+            connection.rollback()
+        connection.execute(text("SELECT 1"))
+        stats = sql_stats.end_request()
+        assert connection.info == info
+    assert stats.count == 1
+
+
+def test_only_slow_statements_are_logged(engine, slow_log, monkeypatch):
+    """ Statements are logged when they take SLOW_QUERY_MS or more
+    """
+    with engine.connect() as connection:
+        monkeypatch.setattr(sql_stats, "SLOW_QUERY_MS", 60000)
+        connection.execute(text("SELECT 1"))
+        assert slow_log == []
+        monkeypatch.setattr(sql_stats, "SLOW_QUERY_MS", 0)
+        connection.execute(text("SELECT 2"))
+    assert len(slow_log) == 1
+    assert "statement=SELECT 2" in slow_log[0]
+
+
+def test_slow_query_log_redacts_by_parameter_name(engine, slow_log,
+                                                  monkeypatch):
+    """ Sensitive parameters are hidden whatever their value holds,
+    separators included
+    """
+    monkeypatch.setattr(sql_stats, "SLOW_QUERY_MS", 0)
+    with engine.connect() as connection:
+        connection.execute(
+            text("SELECT :email_1, :b_hashed_password, :note"),
+            {"email_1": "bob;note=x@hbtn.io",
+             "b_hashed_password": "secret;", "note": "kept"})
+    assert "bob" not in slow_log[0]
+    assert "secret" not in slow_log[0]
+    assert "'email_1': '***'" in slow_log[0]
+    assert "'b_hashed_password': '***'" in slow_log[0]
+    assert "'note': 'kept'" in slow_log[0]
@@ -0,0 +1 @@
+../0x02-Session_authentication/api/v1/throttle.py
\ No newline at end of file
@@ -2,7 +2,7 @@
 """
 User module for the definition of a user class
 """
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String
 from sqlalchemy.ext.declarative import declarative_base
 
 
@@ -13,7 +13,29 @@ class User(Base):
     """ User model definition """
     __tablename__ = "users"
     id = Column(Integer, primary_key=True)
-    email = Column(String(250), nullable=False)
+    email = Column(String(250), nullable=False, unique=True, index=True)
     hashed_password = Column(String(250), nullable=False)
-    session_id = Column(String(250), nullable=True)
-    reset_token = Column(String(250), nullable=True)
+    session_id = Column(String(250), nullable=True, unique=True, index=True)
+    reset_token = Column(String(250), nullable=True, unique=True,
+                         index=True)
+
+
+class UserSession(Base):
+    """ Session model definition: a user may have many live sessions """
+    __tablename__ = "sessions"
+    session_id = Column(String(250), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False,
+                     index=True)
+    created_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    last_seen = Column(DateTime, nullable=False)
+
+
+class ResetToken(Base):
+    """ Reset password token model definition: only the SHA-256 digest
+    of the token is stored """
+    __tablename__ = "reset_tokens"
+    token_hash = Column(String(64), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False,
+                     index=True)
+    expires_at = Column(DateTime, nullable=False, index=True)